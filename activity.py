@@ -15,13 +15,17 @@
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk
+from gi.repository import GObject
 from gettext import gettext as _
 
+import os
 import logging
+import threading
 logger = logging.getLogger('cartoon-builder')
 
 from sugar3.graphics.toolbutton import ToolButton
 from sugar3.graphics.toggletoolbutton import ToggleToolButton
+from sugar3.datastore import datastore
 
 from toolkit.temposlider import TempoSlider
 from toolkit.activity import SharedActivity
@@ -30,6 +34,7 @@ from toolkit.activity_widgets import *
 
 import montage
 import document
+import profiler
 import char
 import ground
 import sound
@@ -39,6 +44,7 @@ from utils import *
 
 
 class CartoonBuilderActivity(SharedActivity):
+    @profiler.profile
     def __init__(self, handle):
         self.notebook = Gtk.Notebook()
         SharedActivity.__init__(self, self.notebook, SERVICE, handle)
@@ -76,21 +82,33 @@ class CartoonBuilderActivity(SharedActivity):
         toolbox.show_all()
         self.toolbar_box = toolbox
 
+    @profiler.profile
     def new_instance(self):
         logger.debug('new_instance')
+        init_style()
         self.montage.restore()
 
+    @profiler.profile
     def resume_instance(self, filepath):
         logger.debug('resume_instance from %s' % filepath)
+        init_style()
         document.load(filepath)
         char.load()
         ground.load()
         sound.load()
         self.montage.restore()
 
+    @profiler.profile
     def save_instance(self, filepath):
         logger.debug('save_instance to %s' % filepath)
-        document.save(filepath)
+
+        # file should exist on return, keep UI responsive meanwhile
+        result = []
+        document.SAVER.save(filepath, result.append)
+        while not result:
+            Gtk.main_iteration()
+        if result[0] is not None:
+            raise result[0]
 
     def share_instance(self, tube_conn, initiating):
         logger.debug('share_instance')
@@ -131,14 +149,96 @@ class CartoonBuilderActivity(SharedActivity):
         clear_tape.set_tooltip(_('Reset'))
         toolbar.insert(clear_tape, -1)
 
+        # shown after checking dependencies to not import them on startup
+        export_gif = ToolButton('image-x-generic')
+        export_gif.connect('clicked', self.__export_cb, 'gif', 'image/gif')
+        export_gif.set_tooltip(_('Export to GIF'))
+        export_gif.props.no_show_all = True
+        toolbar.insert(export_gif, -1)
+
+        export_video = ToolButton('video-x-generic')
+        export_video.connect('clicked', self.__export_cb, 'ogg', 'video/ogg')
+        export_video.set_tooltip(_('Export to video'))
+        export_video.props.no_show_all = True
+        toolbar.insert(export_video, -1)
+
+        self._export_buttons = [export_gif, export_video]
+        GObject.idle_add(self.__check_export_cb, export_gif, export_video,
+                priority=GObject.PRIORITY_LOW)
+
         toolbar.show_all()
 
         return toolbar
 
+    def __check_export_cb(self, export_gif, export_video):
+        import export
+        if export.available('gif'):
+            export_gif.show()
+        if export.available('ogg'):
+            export_video.show()
+        return False
+
     def __clear_tape_cb(self, widget):
         for i in range(TAPE_COUNT):
             self.montage.props.frame = (i, None)
 
+    def __export_cb(self, widget, format, mime_type):
+        import export
+
+        for i in self._export_buttons:
+            i.set_sensitive(False)
+        self.notify_alert(_('Export'), _('Exporting cartoon...'))
+
+        # encode in a thread to not freeze UI, document might be changed
+        # meanwhile, so export its current state
+        thread = threading.Thread(target=self.__export,
+                args=(format, mime_type, session_path('export.' + format),
+                    self.montage.get_delay(), export.snapshot()))
+        thread.daemon = True
+        thread.start()
+
+    def __export(self, format, mime_type, filepath, delay, state):
+        import export
+
+        try:
+            if format == 'gif':
+                export.gif(filepath, delay, state=state)
+            else:
+                export.video(filepath, delay, container=format, state=state)
+            error = None
+        except Exception, e:
+            logger.exception('Cannot export to %s' % format)
+            error = e
+
+        GObject.idle_add(self.__exported_cb, mime_type, filepath, error)
+
+    def __exported_cb(self, mime_type, filepath, error):
+        for i in self._export_buttons:
+            i.set_sensitive(True)
+
+        if error is None:
+            jobject = datastore.create()
+            try:
+                jobject.metadata['title'] = self.metadata['title']
+                jobject.metadata['mime_type'] = mime_type
+                jobject.file_path = filepath
+                datastore.write(jobject, transfer_ownership=True)
+            except Exception, e:
+                logger.exception('Cannot save exported cartoon')
+                error = e
+            finally:
+                jobject.destroy()
+
+        if error is not None:
+            if os.path.exists(filepath):
+                os.unlink(filepath)
+            self.notify_alert(_('Export'),
+                    _('Cannot export cartoon: %s') % error)
+        else:
+            self.notify_alert(_('Export'), _('Cartoon was saved to Journal'))
+
+        return False
+
     def __tempo_cb(self, widget):
         self.montage.set_tempo(widget.get_value())
 
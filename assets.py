@@ -0,0 +1,115 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Decode assets in background threads"""
+
+import Queue
+import logging
+import threading
+import multiprocessing
+from gi.repository import GObject
+
+logger = logging.getLogger('cartoon-builder')
+
+GObject.threads_init()
+
+
+class Future:
+    """Result of function which is being processed by Loader"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._error = None
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self):
+        """Return result, wait for it if function is not processed yet"""
+        self._event.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class Loader(GObject.GObject):
+    """
+    Pool of threads to process functions, e.g., GdkPixbuf decoding which
+    releases GIL. 'loaded' signal is emitted from main loop after one or
+    several submitted functions were processed. Threads are started on
+    first submit() to not spend them in processes which don't load assets.
+    """
+
+    __gsignals__ = {
+        'loaded': (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, [])}
+
+    def __init__(self, workers=None):
+        GObject.GObject.__init__(self)
+
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._loaded_id = None
+        self._workers = workers or multiprocessing.cpu_count()
+        self._started = False
+
+    def submit(self, func, *args):
+        if not self._started:
+            self._started = True
+            for i in range(self._workers):
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+
+        future = Future()
+        self._queue.put((future, func, args))
+        return future
+
+    def _work(self):
+        while True:
+            future, func, args = self._queue.get()
+            try:
+                future._result = func(*args)
+            except Exception, e:
+                logger.error('Cannot load %r: %s' % (args, e))
+                future._error = e
+            future._event.set()
+
+            self._lock.acquire()
+            try:
+                if self._loaded_id is None:
+                    self._loaded_id = GObject.idle_add(self._loaded_cb)
+            finally:
+                self._lock.release()
+
+    def _loaded_cb(self):
+        self._lock.acquire()
+        try:
+            self._loaded_id = None
+        finally:
+            self._lock.release()
+        self.emit('loaded')
+        return False
+
+
+def get(value, placeholder):
+    """Return value or its result if it is a finished Future"""
+    if not isinstance(value, Future):
+        return value
+    if value.done() and value._error is None:
+        return value.result()
+    return placeholder
+
+
+LOADER = Loader()
@@ -0,0 +1,208 @@
+#!/usr/bin/python
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Micro benchmarks for performance sensitive code paths.
+
+Usage:
+
+    python bench.py             # run all benchmarks
+    python bench.py draw        # run only specified ones
+
+Exits with non-zero status if any benchmark didn't fit its budget.
+"""
+
+import os
+import sys
+import glob
+import time
+import shutil
+import tempfile
+import subprocess
+
+BUNDLE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# seconds to import activity module, heavy subsystems should be initialized
+# on first use to not delay mapping activity window
+IMPORT_BUDGET = 1.5
+
+
+def _timeit(func, count):
+    start = time.time()
+    for i in xrange(count):
+        func()
+    return (time.time() - start) / count
+
+
+def _report(name, seconds):
+    sys.stdout.write('%-40s %10.3f ms\n' % (name, seconds * 1000))
+
+
+def _report_size(name, size):
+    sys.stdout.write('%-40s %10.1f KB\n' % (name, size / 1024.))
+
+
+def draw(count=200, size=600):
+    """Per-frame cost of painting screen sized ground and frame"""
+    import gi
+    gi.require_version('Gdk', '3.0')
+    from gi.repository import Gdk
+    from gi.repository import GdkPixbuf
+    import cairo
+    from toolkit import pixbuf as _pixbuf
+
+    def load(filename):
+        return GdkPixbuf.Pixbuf.new_from_file(
+                os.path.join(BUNDLE_PATH, filename)).scale_simple(
+                        size, size, GdkPixbuf.InterpType.BILINEAR)
+
+    ground = load('images/backpics/bigbg01.gif')
+    frame = load('images/pics/Elephant/bigelephant0.gif')
+    target = cairo.ImageSurface(cairo.FORMAT_ARGB32, size, size)
+
+    def from_pixbufs():
+        cr = cairo.Context(target)
+        for pixbuf in (ground, frame):
+            Gdk.cairo_set_source_pixbuf(cr, pixbuf, 0, 0)
+            cr.paint()
+
+    surfaces = [_pixbuf.to_surface(i) for i in (ground, frame)]
+
+    def from_surfaces():
+        cr = cairo.Context(target)
+        for surface in surfaces:
+            cr.set_source_surface(surface, 0, 0)
+            cr.paint()
+
+    _report('draw: cairo_set_source_pixbuf', _timeit(from_pixbufs, count))
+    _report('draw: cached surfaces', _timeit(from_surfaces, count))
+
+
+def startup(workers=(1, 2, 4), size=100):
+    """Time to decode thumbnails of all preinstalled assets"""
+    from gi.repository import GdkPixbuf
+    import assets
+
+    files = []
+    for pattern in ('images/pics/*/*.gif', 'images/backpics/*',
+            'images/sounds/*.png'):
+        files.extend(glob.glob(os.path.join(BUNDLE_PATH, pattern)))
+
+    for count in workers:
+        loader = assets.Loader(count)
+
+        def decode():
+            futures = [loader.submit(
+                    GdkPixbuf.Pixbuf.new_from_file_at_size, i, size, size)
+                    for i in files]
+            for future in futures:
+                future.result()
+
+        _report('startup: %d assets, %d workers' % (len(files), count),
+                _timeit(decode, 1))
+
+
+def _rss():
+    # resident set size of current process, Linux only
+    return int(open('/proc/self/statm').read().split()[1]) * \
+            os.sysconf('SC_PAGE_SIZE')
+
+
+def memory(chars=('Elephant', 'SpaceBlob', 'Turkey'), count=20):
+    """Memory theme keeps after showing every character frame on screen"""
+    root = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(root, 'tmp'))
+        os.mkdir(os.path.join(root, 'data'))
+        os.environ.setdefault('SUGAR_BUNDLE_PATH', BUNDLE_PATH)
+        os.environ['SUGAR_ACTIVITY_ROOT'] = root
+
+        from gi.repository import GdkPixbuf
+        import theme
+
+        if theme.INDEXED is None:
+            sys.stderr.write('memory: numpy is required for indexed '
+                    'frames\n')
+
+        files = []
+        for name in chars:
+            files.extend(sorted(glob.glob(os.path.join(BUNDLE_PATH,
+                    'images', 'pics', name, '*.gif'))))
+
+        rgba = 0
+        for filename in files:
+            __, width, height = GdkPixbuf.Pixbuf.get_file_info(filename)
+            rgba += width * height * 4
+
+        rss = _rss()
+        for filename in files:
+            # levels montage asks for to show frame on tape and screen
+            theme.thumb(filename)
+            theme.scaled(filename, theme.DESKTOP_HEIGHT)
+
+        _report_size('memory: %d frames, RGBA originals' % len(files), rgba)
+        _report_size('memory: %d frames, PIXBUFS' % len(files),
+                theme.PIXBUFS.size)
+        if theme.INDEXED is not None:
+            _report_size('memory: %d frames, INDEXED' % len(files),
+                    theme.INDEXED.size)
+        _report_size('memory: %d frames, resident growth' % len(files),
+                _rss() - rss)
+        _report('memory: original of indexed frame',
+                _timeit(lambda: theme.orig(files[0]), count))
+    finally:
+        shutil.rmtree(root)
+
+
+def imports(budget=IMPORT_BUDGET):
+    """Time to import activity in fresh interpreter, fail if over budget"""
+    root = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(root, 'tmp'))
+        os.mkdir(os.path.join(root, 'data'))
+        env = dict(os.environ, SUGAR_BUNDLE_PATH=BUNDLE_PATH,
+                SUGAR_ACTIVITY_ROOT=root)
+        code = 'import time\n' \
+               'start = time.time()\n' \
+               'import activity\n' \
+               'print time.time() - start\n'
+        out = subprocess.check_output([sys.executable, '-c', code],
+                cwd=BUNDLE_PATH, env=env)
+    finally:
+        shutil.rmtree(root)
+
+    seconds = float(out.split()[-1])
+    _report('imports: activity', seconds)
+
+    if seconds > budget:
+        sys.stderr.write('imports: over %.2fs budget\n' % budget)
+        return False
+    return True
+
+
+BENCHMARKS = ['draw', 'startup', 'memory', 'imports']
+
+
+def main(names):
+    failed = False
+    for name in names or BENCHMARKS:
+        if globals()[name]() is False:
+            failed = True
+    return failed and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,163 @@
+#!/usr/bin/python
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Index of preinstalled assets.
+
+Index keeps file lists of asset directories and dimensions, sizes and
+content hashes of asset files, so theme modules don't need to hit the
+filesystem on import. It is generated at build time by setup.py or
+manually with
+
+    python catalog.py
+
+otherwise it will be generated on the first run in activity data directory,
+that copy is rebuilt once activity bundle is upgraded.
+"""
+
+import os
+import hashlib
+import logging
+try: import simplejson as json
+except ImportError:
+     import json
+
+logger = logging.getLogger('cartoon-builder')
+
+FILENAME = 'catalog.json'
+VERSION = 3
+
+# directories with preinstalled assets relatively to bundle
+DIRS = ['images/pics/Elephant', 'images/pics/SpaceBlob', 'images/pics/Turkey',
+        'images/pics', 'images/backpics', 'images/sounds', 'sounds']
+
+
+def listdir(dir):
+    """Sorted list of files in asset directory, paths include dir"""
+    return _index()['dirs'].get(dir, [])
+
+
+def info(file):
+    """Dictionary with 'size', 'sha1' and, for images, 'width', 'height'"""
+    return _index()['files'].get(file)
+
+
+def build(bundle_path):
+    """Scan bundle and return index"""
+    from gi.repository import GdkPixbuf
+
+    out = {'version': VERSION, 'bundle': _bundle_version(bundle_path),
+            'dirs': {}, 'files': {}}
+
+    for dir in DIRS:
+        files = []
+        for name in sorted(os.listdir(os.path.join(bundle_path, dir))):
+            file = os.path.join(dir, name)
+            filepath = os.path.join(bundle_path, file)
+            if os.path.isdir(filepath):
+                continue
+            files.append(file)
+
+            data = open(filepath, 'rb').read()
+            node = {'size': len(data), 'sha1': hashlib.sha1(data).hexdigest()}
+            file_info = GdkPixbuf.Pixbuf.get_file_info(filepath)
+            if file_info and file_info[0]:
+                node['width'] = file_info[1]
+                node['height'] = file_info[2]
+            out['files'][file] = node
+
+        out['dirs'][dir] = files
+
+    return out
+
+
+def write(bundle_path, path=None):
+    """
+    Build index and write it to path, bundle's catalog.json by default.
+
+    File is not touched if its content is the same already.
+    """
+    if path is None:
+        path = os.path.join(bundle_path, FILENAME)
+    index = build(bundle_path)
+    content = json.dumps(index, indent=1, sort_keys=True,
+            separators=(',', ': ')) + '\n'
+
+    if os.path.exists(path) and open(path).read() == content:
+        return index
+
+    out = open(path, 'w')
+    try:
+        out.write(content)
+    finally:
+        out.close()
+    return index
+
+
+def _bundle_version(bundle_path):
+    version = ''
+    for line in open(os.path.join(bundle_path, 'activity', 'activity.info')):
+        key, sep, value = line.partition('=')
+        if sep and key.strip() in ('version', 'activity_version') \
+                and not version:
+            version = value.strip()
+    return version
+
+
+_cache = None
+
+def _index():
+    global _cache
+    if _cache is not None:
+        return _cache
+
+    from sugar3.activity.activity import get_bundle_path, get_activity_root
+
+    bundle_path = os.path.join(get_bundle_path(), FILENAME)
+    data_path = os.path.join(get_activity_root(), 'data', FILENAME)
+    version = _bundle_version(get_bundle_path())
+    # activity.info is replaced on every bundle upgrade
+    installed = os.stat(os.path.join(get_bundle_path(), 'activity',
+            'activity.info')).st_mtime
+
+    # bundle's index is regenerated by setup.py along with assets it
+    # describes, data one might be left from previous bundle of the same
+    # version, e.g., while developing
+    for path, since in ((bundle_path, 0), (data_path, installed)):
+        if not os.path.exists(path):
+            continue
+        try:
+            index = json.load(open(path))
+            if index.get('version') == VERSION and \
+                    index.get('bundle') == version and \
+                    os.stat(path).st_mtime >= since:
+                _cache = index
+                return _cache
+        except Exception, e:
+            logger.warning('Cannot read assets index %s: %s' % (path, e))
+
+    logger.debug('build assets index to %s' % data_path)
+    try:
+        _cache = write(get_bundle_path(), data_path)
+    except Exception, e:
+        logger.warning('Cannot write assets index %s: %s' % (data_path, e))
+        _cache = build(get_bundle_path())
+
+    return _cache
+
+
+if __name__ == '__main__':
+    write(os.path.dirname(os.path.abspath(__file__)))
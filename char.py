@@ -13,16 +13,16 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import gi
-import os
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk
-import glob
 from gettext import gettext as _
 
 import toolkit.chooser as chooser
 from toolkit import pixbuf
 
 import theme
+import assets
+import catalog
 
 
 def load():
@@ -40,12 +40,16 @@ class Frame:
         self.name = ''
         self._thumb = None
         self._orig = None
+        # encoded _orig to not compress pixels again, reset if they change
+        self._data = None
+        self._levels = theme.Levels()
 
     def serialize(self):
-        if self._orig:
-            return pixbuf.to_str(self._orig)
-        else:
+        if not self._orig:
             return ''
+        if self._data is None:
+            self._data = pixbuf.to_str(self._orig)
+        return self._data
 
     def empty(self):
         return False
@@ -55,12 +59,16 @@ class Frame:
 
     def thumb(self):
         if self._thumb == None:
-            self._thumb = theme.scale(self.orig())
+            self._thumb = self.scaled(theme.THUMB_SIZE)
         return self._thumb
 
     def orig(self):
         return self._orig
 
+    def scaled(self, size):
+        """Return orig() scaled to size, see theme.Levels"""
+        return self._levels.get(self.orig(), size)
+
     def select(self):
         return True
 
@@ -74,9 +82,24 @@ class PreinstalledFrame(Frame):
         return False
 
     def orig(self):
-        if self._orig == None:
-            self._orig = theme.pixbuf(self._filename)
-        return self._orig
+        return theme.orig(self._filename)
+
+    def scaled(self, size):
+        return theme.scaled(self._filename, size)
+
+    def thumb(self):
+        # decode in background on first use, True when it is decoded
+        if self._thumb is None:
+            self._thumb = assets.LOADER.submit(theme.thumb, self._filename)
+        if self._thumb is not True:
+            if not self._thumb.done():
+                return theme.EMPTY_THUMB
+            if self._thumb._error is not None:
+                # do not retry decoding broken file in main loop
+                return theme.EMPTY_THUMB
+            self._thumb = True
+        # pixbufs might be evicted from cache, do not pin them here
+        return theme.thumb(self._filename)
 
 
 class EmptyFrame(Frame):
@@ -88,6 +111,10 @@ class EmptyFrame(Frame):
     def custom(self):
         return False
 
+    def scaled(self, size):
+        # share levels of the same image between all empty frames
+        return theme.scaled(theme.EMPTY_FILENAME, size)
+
     def empty(self):
         return True;
 
@@ -95,7 +122,27 @@ class EmptyFrame(Frame):
 class RestoredFrame(Frame):
     def __init__(self, id, data):
         Frame.__init__(self, id)
-        self._orig = pixbuf.from_str(data)
+        # PNG content or function to read it, decoded on first use
+        self._data = data
+
+    def serialize(self):
+        if callable(self._data):
+            self._data = self._data()
+        return self._data
+
+    def orig(self):
+        if self._orig is None:
+            self._orig = pixbuf.from_str(self.serialize())
+            if self._orig is None:
+                # corrupted content, error is logged by from_str()
+                self._orig = theme.EMPTY_ORIG
+        return self._orig
+
+    def thumb(self):
+        # decode in background to not block restoring document
+        if self._thumb is None:
+            self._thumb = assets.LOADER.submit(self.scaled, theme.THUMB_SIZE)
+        return assets.get(self._thumb, theme.EMPTY_THUMB)
 
 
 class CustomFrame(Frame):
@@ -111,12 +158,13 @@ class CustomFrame(Frame):
     def select(self):
         if self._orig:
             return True;
-        self.name, self.id, self._orig = chooser.pick(
+        self.name, self.id, self._orig, self._data = chooser.pick(
                 lambda jobject: (jobject.metadata['title'], jobject.object_id,
-                        theme.pixbuf(jobject.file_path)),
-                (None, None, None), what=chooser.IMAGE)
+                        theme.pixbuf(jobject.file_path),
+                        pixbuf.read_png(jobject.file_path)),
+                (None, None, None, None), what=chooser.IMAGE)
         if self.name:
-            self._thumb = theme.scale(self._orig)
+            self._thumb = self.scaled(theme.THUMB_SIZE)
             return True
         else:
             return False
@@ -128,10 +176,10 @@ class Char:
         self.frames = []
 
         if dir:
-            for i in sorted(glob.glob(theme.path(dir, '*'))):
-                self.frames.append(PreinstalledFrame(
-                        os.path.join(dir, os.path.basename(i))))
-            self._thumb = theme.pixbuf(thumbfile, theme.THUMB_SIZE)
+            for i in catalog.listdir(dir):
+                self.frames.append(PreinstalledFrame(i))
+            self._thumbfile = thumbfile
+            self._thumb = None
             self._custom = False
         else:
             for i in range(0, theme.FRAME_ROWS * theme.FRAME_COLS):
@@ -143,7 +191,9 @@ class Char:
         return self._custom
 
     def thumb(self):
-        return self._thumb
+        if self._thumb is None:
+            self._thumb = assets.LOADER.submit(theme.thumb, self._thumbfile)
+        return assets.get(self._thumb, theme.EMPTY_THUMB)
 
     def clean(self, index):
         if self.frames[index].custom():
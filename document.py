@@ -15,7 +15,11 @@
 import gi
 gi.require_version('Gtk', '3.0')
 import os
+import shutil
+import hashlib
+import threading
 from gi.repository import Gtk
+from gi.repository import GObject
 import logging
 try: import simplejson as json
 except ImportError: 
@@ -30,69 +34,238 @@ from toolkit.tarball import Tarball
 
 logger = logging.getLogger('cartoon-builder')
 
+# bytes to read at once while hashing payload files
+CHUNK_SIZE = 64 * 1024
+
 
 class Document:
     tape = []
+    hold = []
     ground = None
     sound = None
 
     for i in range(theme.TAPE_COUNT):
         tape.append(EmptyFrame())
+        hold.append(1)
 
 
 def clean(index):
     from char import Frame
     Document.tape[index] = EmptyFrame()
+    Document.hold[index] = 1
+
+
+def reset():
+    """Make document empty"""
+    for i in range(theme.TAPE_COUNT):
+        clean(i)
+    Document.ground = None
+    Document.sound = None
+
+
+def playlist():
+    """
+    Compile tape to list of (tape index, hold) pairs.
+
+    Empty frames are skipped and neighbour occurrences of the same frame are
+    merged to one entry, hold is a number of tempo ticks to show frame.
+    """
+    out = []
+
+    for i, frame in enumerate(Document.tape):
+        if frame.empty():
+            continue
+        if out and _same(Document.tape[out[-1][0]], frame):
+            out[-1] = (out[-1][0], out[-1][1] + Document.hold[i])
+        else:
+            out.append((i, Document.hold[i]))
+
+    if not out:
+        out.append((0, 1))
+
+    return out
+
+
+def _same(a, b):
+    return a is b or a.id is not None and a.id == b.id
+
+
+class Snapshot:
+    """Copy of Document state to save it while Document is being changed"""
+
+    def __init__(self):
+        self.tape = list(Document.tape)
+        self.hold = list(Document.hold)
+        self.ground = Document.ground
+        self.sound = Document.sound
+
+
+class Saver:
+    """
+    Save document in a worker thread.
+
+    Snapshot is taken on the main loop and written out of it, cb(error) is
+    called on the main loop when the file is ready. Requests made while
+    previous write is in progress are coalesced, the latest snapshot is
+    written once and copied to the rest of requested files.
+    """
+
+    def __init__(self):
+        self._thread = None
+        self._snapshot = None
+        self._requests = []
 
+    def save(self, filepath, cb):
+        self._snapshot = Snapshot()
+        self._requests.append((filepath, cb))
+        if self._thread is None:
+            self._start()
 
-def save(filepath):
-    tar = Tarball(filepath, 'w')
+    def _start(self):
+        self._thread = threading.Thread(target=self._write,
+                args=(self._snapshot, self._requests))
+        self._thread.daemon = True
+        self._snapshot = None
+        self._requests = []
+        self._thread.start()
 
+    def _write(self, snapshot, requests):
+        error = None
+        try:
+            filepath = requests[-1][0]
+            save(filepath, snapshot)
+            for path in set([i for i, cb in requests]):
+                if path != filepath:
+                    shutil.copyfile(filepath, path)
+        except Exception, e:
+            logger.error('Cannot save document: %s' % e)
+            error = e
+        GObject.idle_add(self._done_cb, requests, error)
+
+    def _done_cb(self, requests, error):
+        self._thread = None
+        if self._requests:
+            self._start()
+        for filepath, cb in requests:
+            cb(error)
+        return False
+
+
+SAVER = Saver()
+
+
+def save(filepath, snapshot=None):
+    """Save Document, or its snapshot taken earlier, to filepath"""
+    if snapshot is None:
+        snapshot = Snapshot()
+
+    # write to new file to not truncate archive restored objects read from
+    tmp_path = filepath + '.tmp'
+    tar = Tarball(tmp_path, 'w')
+    try:
+        try:
+            _write_archive(tar, snapshot)
+        finally:
+            tar.close()
+        os.rename(tmp_path, filepath)
+    except:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _write_archive(tar, snapshot):
     cfg = {'ground': {},
             'sound': {},
             'frames': {},
             'tape': []}
 
-    def _save(node, arcname, value):
+    # payloads are named by content hash to store equal ones only once
+    stored = set()
+
+    def _store(value, suffix=''):
+        # objects backed by files, i.e. sounds, are streamed by chunks
+        path = hasattr(value, 'path') and value.path()
+        if path:
+            arcname = _digest(path) + suffix
+        else:
+            data = value.serialize()
+            arcname = hashlib.sha1(data).hexdigest() + suffix
+        if arcname not in stored:
+            if path:
+                tar.write_file(arcname, path)
+            else:
+                tar.write(arcname, data)
+            stored.add(arcname)
+        return arcname
+
+    def _save(node, suffix, value):
         if value.custom():
             node['custom'] = True
-            node['filename'] = arcname
-            tar.write(arcname, value.serialize())
+            node['filename'] = _store(value, suffix)
         else:
             node['custom'] = False
         node['name'] = unicode(value.name)
         node['id'] = value.id
 
-    _save(cfg['ground'], 'ground.png', Document.ground)
-    _save(cfg['sound'], 'sound', Document.sound)
+    _save(cfg['ground'], '.png', snapshot.ground)
+    _save(cfg['sound'], '', snapshot.sound)
 
-    for i, frame in enumerate(
-            [i for i in set(Document.tape) if not i.empty() and i.custom()]):
-        arcname = 'frame%03d.png' % i
-        cfg['frames'][frame.id] = arcname
-        tar.write(arcname, frame.serialize())
+    for frame in set(snapshot.tape):
+        if not frame.empty() and frame.custom():
+            cfg['frames'][frame.id] = _store(frame, '.png')
 
-    for i, frame in enumerate(Document.tape):
+    for i, frame in enumerate(snapshot.tape):
         if not frame.empty():
             node = {}
             node['custom'] = frame.custom()
             node['id'] = frame.id
             node['index'] = i
+            if snapshot.hold[i] != 1:
+                node['hold'] = snapshot.hold[i]
             cfg['tape'].append(node)
 
     tar.write('MANIFEST', json.dumps(cfg))
-    tar.close()
+
+
+def _digest(path):
+    sha1 = hashlib.sha1()
+    f = open(path, 'rb')
+    try:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha1.update(chunk)
+    finally:
+        f.close()
+    return sha1.hexdigest()
 
 
 def load(filepath):
+    """
+    Load document from filepath.
+
+    Only MANIFEST is parsed right away, custom objects keep the archive
+    open until they are collected and read their content on first use.
+    """
+    tar = None
     try:
         tar = Tarball(filepath)
         cfg = json.loads(tar.read('MANIFEST'))
+        names = set(tar.getnames())
+
+        def _reader(arcname):
+            # content is read later, so check its presence right now,
+            # archive names are UTF-8 encoded like Tarball.read() expects
+            if arcname.encode('utf8') not in names:
+                raise KeyError('Cannot find %s in archive' % arcname)
+            return lambda: tar.read(arcname)
 
         def _load(node, restored_class, preinstalled_class):
             if node['custom']:
                 return restored_class(node['name'], node['id'],
-                        tar.read(node['filename']))
+                        _reader(node['filename']))
             else:
                 return preinstalled_class(node['name'], node['id'])
 
@@ -100,9 +273,13 @@ def load(filepath):
         Document.sound = _load(cfg['sound'], RestoredSound, PreinstalledSound)
 
         frames = {}
+        restored = {}
 
         for id, arcname in cfg['frames'].items():
-            frames[id] = RestoredFrame(id, tar.read(arcname))
+            # frames with equal content share one decoded object
+            if arcname not in restored:
+                restored[arcname] = RestoredFrame(id, _reader(arcname))
+            frames[id] = restored[arcname]
 
         for node in cfg['tape']:
             i = node['index']
@@ -111,8 +288,14 @@ def load(filepath):
                     Document.tape[i] = frames[node['id']]
                 else:
                     Document.tape[i] = PreinstalledFrame(node['id'])
-
-        tar.close()
+                Document.hold[i] = max(1, int(node.get('hold', 1)))
 
     except Exception, e:
         logger.error('Cannot load jobject: %s' % e)
+        # do not leave objects that read from closed archive
+        reset()
+        if tar is not None:
+            tar.close()
+        return False
+
+    return True
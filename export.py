@@ -0,0 +1,418 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Export cartoon to files which can be shared outside of the activity"""
+
+import os
+import sys
+import shutil
+import time
+import struct
+import logging
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+from gi.repository import Gdk
+from gi.repository import GdkPixbuf
+import cairo
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import sound
+from document import Document, playlist
+
+logger = logging.getLogger('cartoon-builder')
+
+SIZE = 360
+FRAMERATE = 25
+
+# video, audio encoders and muxer for supported video containers
+CONTAINERS = {
+        'ogg': ('theoraenc', 'vorbisenc', 'oggmux'),
+        'webm': ('vp8enc', 'vorbisenc', 'webmmux')}
+
+_PALETTE_SIZE = 256
+_LUT_CHUNK = 4096
+
+_AUDIO_RATE = 44100
+_AUDIO_SAMPLE = 4
+_AUDIO_CAPS = 'audio/x-raw,format=S16LE,layout=interleaved,' \
+        'rate=%d,channels=2' % _AUDIO_RATE
+_AUDIO_CHUNK = 4096
+# limit appsrc queues to keep memory usage flat
+_QUEUE_BYTES = 1 << 20
+# longest video buffer, long holds are split to not let sound run ahead of
+# video further than appsrc queues can keep
+_VIDEO_CHUNK = 500 * Gst.MSECOND
+
+
+class ExportError(Exception):
+    pass
+
+
+def available(format):
+    """Can document be exported to format, 'gif' or one of CONTAINERS"""
+    if format == 'gif':
+        return numpy is not None
+    return not _missing(CONTAINERS[format])
+
+
+def compose(ground, frame, size=SIZE):
+    """Return cairo surface with frame pixbuf painted over ground one"""
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, size, size)
+    cr = cairo.Context(surface)
+
+    for pixbuf in (ground, frame):
+        if not pixbuf:
+            continue
+        if pixbuf.get_width() != size or pixbuf.get_height() != size:
+            pixbuf = pixbuf.scale_simple(size, size,
+                    GdkPixbuf.InterpType.BILINEAR)
+        Gdk.cairo_set_source_pixbuf(cr, pixbuf, 0, 0)
+        cr.paint()
+
+    surface.flush()
+    return surface
+
+
+def snapshot():
+    """
+    Return (ground, sound, [(frame, hold)...]) of current document.
+
+    Pass it as state to exporting functions which run in a thread to not
+    depend on changes made to document meanwhile.
+    """
+    return Document.ground, Document.sound, \
+            [(Document.tape[i], hold) for i, hold in playlist()]
+
+
+def frames(delay, size=SIZE, state=None):
+    """
+    Generate (surface, duration) pairs for every playlist entry.
+
+    delay is a tempo delay in milliseconds, surfaces are composed one by one
+    to not keep the whole cartoon in memory.
+    """
+    ground, __, entries = state or snapshot()
+    ground = ground and ground.scaled(size)
+
+    for frame, hold in entries:
+        yield compose(ground, frame.scaled(size), size), hold * delay
+
+
+def gif(filepath, delay, size=SIZE, state=None):
+    """Write animated GIF of current document to filepath"""
+    if numpy is None:
+        raise ExportError('numpy is required to export GIF')
+
+    # both passes should see the same document
+    state = state or snapshot()
+
+    # the first pass collects colors for shared palette
+    histogram = numpy.zeros(1 << 15, dtype=numpy.int64)
+    for surface, duration in frames(delay, size, state):
+        histogram += numpy.bincount(_rgb15(surface), minlength=1 << 15)
+
+    palette, lut = _quantize(histogram)
+
+    # the second pass streams quantized frames one by one
+    out = file(filepath, 'wb')
+    try:
+        writer = _GifWriter(out, size, size, palette)
+        for surface, duration in frames(delay, size, state):
+            writer.write(lut[_rgb15(surface)].tostring(), duration)
+        writer.close()
+    finally:
+        out.close()
+
+
+def png(dirpath, size=SIZE):
+    """Write current document to dirpath as PNG image per tempo tick"""
+    if not os.path.isdir(dirpath):
+        os.makedirs(dirpath)
+
+    ground = Document.ground and Document.ground.scaled(size)
+    index = 0
+
+    for tape_num, hold in playlist():
+        surface = compose(ground, Document.tape[tape_num].scaled(size), size)
+        first = os.path.join(dirpath, '%04d.png' % index)
+        surface.write_to_png(first)
+        for i in range(1, hold):
+            shutil.copyfile(first,
+                    os.path.join(dirpath, '%04d.png' % (index + i)))
+        index += hold
+
+
+def video(filepath, delay, size=SIZE, container='ogg', state=None):
+    """
+    Encode current document to video file with looped document sound.
+
+    Returns encoding throughput in frames per second. Function is
+    synchronous and doesn't need display or running main loop.
+    """
+    missing = _missing(CONTAINERS[container])
+    if missing:
+        raise ExportError('missing gstreamer elements: %s' %
+                ', '.join(missing))
+    video_encoder, audio_encoder, muxer = CONTAINERS[container]
+    state = state or snapshot()
+
+    if sys.byteorder == 'little':
+        pixel_format = 'BGRx'
+    else:
+        pixel_format = 'xRGB'
+
+    description = [
+            'appsrc name=video format=time block=true max-bytes=%d '
+                'caps="video/x-raw,format=%s,width=%d,height=%d,'
+                'framerate=0/1" ! videorate ! video/x-raw,framerate=%d/1 ! '
+                'videoconvert ! %s ! queue ! %s name=mux ! '
+                'filesink location="%s"' % (_QUEUE_BYTES, pixel_format,
+                size, size, FRAMERATE, video_encoder, muxer, filepath)]
+
+    pcm = None
+    uri = state[1] and state[1].uri()
+    if uri:
+        pcm_path = filepath + '.pcm'
+        sound.decode(uri, pcm_path, _AUDIO_CAPS)
+        pcm = file(pcm_path, 'rb')
+        os.unlink(pcm_path)
+        description.append('appsrc name=audio format=time block=true '
+                'max-bytes=%d caps="%s" ! audioconvert ! %s ! queue ! mux.'
+                % (_QUEUE_BYTES, _AUDIO_CAPS, audio_encoder))
+
+    pipeline = Gst.parse_launch(' '.join(description))
+    videosrc = pipeline.get_by_name('video')
+    audiosrc = pipeline.get_by_name('audio')
+
+    start = time.time()
+    position = 0
+    audio_position = 0
+
+    try:
+        pipeline.set_state(Gst.State.PLAYING)
+
+        for surface, duration in frames(delay, size, state):
+            data = str(surface.get_data())
+            end = position + duration * Gst.MSECOND
+            while position < end:
+                duration = min(end - position, _VIDEO_CHUNK)
+                if pcm:
+                    # interleave sources by time to not block on full queues
+                    audio_position = _push_audio(audiosrc, pcm,
+                            audio_position, position + duration)
+                buf = Gst.Buffer.new_wrapped(data)
+                buf.pts = position
+                buf.duration = duration
+                if videosrc.emit('push-buffer', buf) != Gst.FlowReturn.OK:
+                    break
+                position += duration
+            if position < end:
+                break
+
+        videosrc.emit('end-of-stream')
+        if pcm:
+            audiosrc.emit('end-of-stream')
+
+        message = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE,
+                Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+        if pcm:
+            pcm.close()
+
+    if message.type == Gst.MessageType.ERROR:
+        raise ExportError(message.parse_error()[0].message)
+
+    fps = position * FRAMERATE / Gst.SECOND / max(time.time() - start, 1e-6)
+    logger.debug('video exported to %s with %.1f fps' % (filepath, fps))
+
+    return fps
+
+
+def _missing(elements):
+    Gst.init(None)
+    return [i for i in elements if Gst.ElementFactory.find(i) is None]
+
+
+def _push_audio(src, pcm, position, end):
+    # push looped raw sound till the end timestamp
+    while position < end:
+        samples = (end - position) * _AUDIO_RATE / Gst.SECOND + 1
+        size = min(samples, _AUDIO_CHUNK) * _AUDIO_SAMPLE
+        data = pcm.read(size)
+        if not data:
+            pcm.seek(0)
+            data = pcm.read(size)
+            if not data:
+                return end
+        buf = Gst.Buffer.new_wrapped(data)
+        buf.pts = position
+        buf.duration = len(data) / _AUDIO_SAMPLE * Gst.SECOND / _AUDIO_RATE
+        if src.emit('push-buffer', buf) != Gst.FlowReturn.OK:
+            return end
+        position += buf.duration
+    return position
+
+
+def _rgb15(surface):
+    # reduce RGB24 pixels to 5 bits per channel histogram keys
+    width = surface.get_width()
+    height = surface.get_height()
+    data = numpy.frombuffer(surface.get_data(), dtype=numpy.uint8)
+    pixels = data.reshape(height, surface.get_stride())[:, :width * 4]
+    pixels = pixels.reshape(height * width, 4).astype(numpy.uint16)
+
+    if sys.byteorder == 'little':
+        b, g, r = pixels[:, 0], pixels[:, 1], pixels[:, 2]
+    else:
+        r, g, b = pixels[:, 1], pixels[:, 2], pixels[:, 3]
+
+    return ((r >> 3) << 10) | ((g >> 3) << 5) | (b >> 3)
+
+
+def _quantize(histogram):
+    """Median cut histogram, return palette and key to index lookup table"""
+    keys = numpy.nonzero(histogram)[0]
+    counts = histogram[keys]
+    colors = numpy.column_stack(
+            ((keys >> 10) & 31, (keys >> 5) & 31, keys & 31))
+
+    boxes = [numpy.arange(len(keys))]
+    while len(boxes) < _PALETTE_SIZE:
+        # split the most populated box which still has different colors
+        splittable = [i for i, box in enumerate(boxes) if
+                (colors[box].max(axis=0) - colors[box].min(axis=0)).any()]
+        if not splittable:
+            break
+        i = max(splittable, key=lambda i: counts[boxes[i]].sum())
+        box = boxes.pop(i)
+
+        channel = (colors[box].max(axis=0) - colors[box].min(axis=0)).argmax()
+        box = box[colors[box, channel].argsort(kind='mergesort')]
+        cumulative = counts[box].cumsum()
+        median = cumulative.searchsorted(cumulative[-1] / 2.)
+        median = min(max(median, 1), len(box) - 1)
+        boxes.extend([box[:median], box[median:]])
+
+    palette = numpy.array([numpy.average(colors[box], axis=0,
+            weights=counts[box]) for box in boxes])
+    palette = numpy.round(palette).astype(numpy.uint16)
+    palette = (palette << 3) | (palette >> 2)
+
+    lut = numpy.zeros(1 << 15, dtype=numpy.uint8)
+    reference = palette.astype(numpy.int32)
+    for start in range(0, len(keys), _LUT_CHUNK):
+        chunk = keys[start:start + _LUT_CHUNK]
+        rgb = colors[start:start + _LUT_CHUNK].astype(numpy.int32)
+        rgb = (rgb << 3) | (rgb >> 2)
+        distance = ((rgb[:, None, :] - reference[None, :, :]) ** 2).sum(axis=2)
+        lut[chunk] = distance.argmin(axis=1)
+
+    return [tuple(i) for i in palette.tolist()], lut
+
+
+class _GifWriter:
+    """Stream indexed frames to GIF89a file with shared global palette"""
+
+    def __init__(self, out, width, height, palette):
+        self._out = out
+        self._width = width
+        self._height = height
+
+        colors = list(palette) + [(0, 0, 0)] * (_PALETTE_SIZE - len(palette))
+
+        out.write('GIF89a')
+        out.write(struct.pack('<HHBBB', width, height, 0xF7, 0, 0))
+        out.write(''.join([struct.pack('BBB', *i) for i in colors]))
+        # NETSCAPE2.0 extension to loop forever
+        out.write('\x21\xFF\x0BNETSCAPE2.0\x03\x01\x00\x00\x00')
+
+    def write(self, indices, duration):
+        out = self._out
+        out.write(struct.pack('<BBBBHBB', 0x21, 0xF9, 4, 0,
+                max(1, int(round(duration / 10.))), 0, 0))
+        out.write(struct.pack('<BHHHHB', 0x2C, 0, 0,
+                self._width, self._height, 0))
+        out.write('\x08')
+        data = _lzw(indices)
+        for i in xrange(0, len(data), 255):
+            block = data[i:i + 255]
+            out.write(chr(len(block)))
+            out.write(block)
+        out.write('\x00')
+
+    def close(self):
+        self._out.write('\x3B')
+
+
+def _lzw(data, min_code_size=8):
+    """GIF flavour of LZW compression of string with palette indices"""
+    clear = 1 << min_code_size
+    end = clear + 1
+
+    out = bytearray()
+    acc = 0
+    bits = 0
+
+    table = dict([(chr(i), i) for i in xrange(clear)])
+    next_code = end + 1
+    width = min_code_size + 1
+
+    def emit(code, acc, bits):
+        acc |= code << bits
+        bits += width
+        while bits >= 8:
+            out.append(acc & 0xFF)
+            acc >>= 8
+            bits -= 8
+        return acc, bits
+
+    acc, bits = emit(clear, acc, bits)
+    prefix = ''
+
+    for char in data:
+        string = prefix + char
+        if string in table:
+            prefix = string
+            continue
+
+        acc, bits = emit(table[prefix], acc, bits)
+        if next_code >= 1 << width and width < 12:
+            width += 1
+
+        if next_code < 4095:
+            table[string] = next_code
+            next_code += 1
+        else:
+            acc, bits = emit(clear, acc, bits)
+            table = dict([(chr(i), i) for i in xrange(clear)])
+            next_code = end + 1
+            width = min_code_size + 1
+
+        prefix = char
+
+    if prefix:
+        acc, bits = emit(table[prefix], acc, bits)
+        if next_code >= 1 << width and width < 12:
+            width += 1
+    acc, bits = emit(end, acc, bits)
+    if bits:
+        out.append(acc & 0xFF)
+
+    return str(out)
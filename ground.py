@@ -22,6 +22,7 @@ import toolkit.chooser as chooser
 from toolkit import pixbuf
 
 import theme
+import assets
 
 
 def load():
@@ -32,33 +33,51 @@ def load():
 
 
 class Ground:
-    def __init__(self, name, id):
+    def __init__(self, name, id, filename=None):
         self.name = name
         self.id = id
+        self._filename = filename
         self._thumb = None
+        self._orig = None
+        # encoded orig() to not compress pixels again on every save
+        self._data = None
+        self._levels = theme.Levels()
 
     def custom(self):
         return True
 
     def serialize(self):
-        return pixbuf.to_str(self._orig)
+        if self._data is None:
+            self._data = pixbuf.to_str(self.orig())
+        return self._data
 
     def thumb(self):
         if not self._thumb:
-            self._thumb = theme.scale(self._orig)
-        return self._thumb
+            if self._filename:
+                self._thumb = assets.LOADER.submit(theme.thumb,
+                        self._filename)
+            else:
+                self._thumb = self.scaled(theme.THUMB_SIZE)
+        return assets.get(self._thumb, theme.EMPTY_THUMB)
 
     def orig(self):
+        if self._orig is None and self._filename:
+            return theme.orig(self._filename)
         return self._orig
 
+    def scaled(self, size):
+        """Return orig() scaled to size, see theme.level() and theme.Levels"""
+        if self._filename:
+            return theme.scaled(self._filename, size)
+        return self._levels.get(self.orig(), size)
+
     def select(self):
         return self
 
 
 class PreinstalledGround(Ground):
     def __init__(self, name, filename):
-        Ground.__init__(self, name, filename)
-        self._orig = theme.pixbuf(filename)
+        Ground.__init__(self, name, filename, filename)
 
     def custom(self):
         return False
@@ -66,8 +85,7 @@ class PreinstalledGround(Ground):
 
 class CustomGround(Ground):
     def __init__(self, name, filename):
-        Ground.__init__(self, name, None)
-        self._orig = theme.pixbuf(filename)
+        Ground.__init__(self, name, None, filename)
 
     def select(self):
         try:
@@ -80,13 +98,34 @@ class CustomGround(Ground):
 class RestoredGround(Ground):
     def __init__(self, name, id, data):
         Ground.__init__(self, name, id)
-        self._orig = pixbuf.from_str(data)
+        # PNG content or function to read it, decoded on first use
+        self._data = data
+
+    def serialize(self):
+        if callable(self._data):
+            self._data = self._data()
+        return self._data
+
+    def thumb(self):
+        # decode in background to not block restoring document
+        if self._thumb is None:
+            self._thumb = assets.LOADER.submit(self.scaled, theme.THUMB_SIZE)
+        return assets.get(self._thumb, theme.EMPTY_THUMB)
+
+    def orig(self):
+        if self._orig is None:
+            self._orig = pixbuf.from_str(self.serialize())
+            if self._orig is None:
+                # corrupted content, error is logged by from_str()
+                self._orig = theme.EMPTY_ORIG
+        return self._orig
 
 
 class JournalGround(Ground):
     def __init__(self, jobject):
         Ground.__init__(self, jobject.metadata['title'], jobject.object_id)
         self._orig = theme.pixbuf(jobject.file_path)
+        self._data = pixbuf.read_png(jobject.file_path)
         THEMES.append(self)
 
 THEMES = [
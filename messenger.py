@@ -38,16 +38,19 @@ class Slot:
             data = json.loads(raw)
             self.seqno = data['seqno']
             self.oid = data['oid']
+            self.hold = data.get('hold', 1)
             self.sender = sender
         else:
             self.seqno = -1
             self.oid = None
+            self.hold = 1
             self.sender = None
 
     def serialize(self):
         return json.dumps({
             'seqno': self.seqno,
-            'oid': self.oid})
+            'oid': self.oid,
+            'hold': self.hold})
 
 
 class Messenger(ExportedGObject):
@@ -61,6 +64,7 @@ class Messenger(ExportedGObject):
         self._view = view
 
         self._view.connect('frame-changed', self._frame_changed_cb)
+        self._view.connect('hold-changed', self._hold_changed_cb)
         self._view.connect('ground-changed', self._ground_changed_cb)
         self._view.connect('sound-changed', self._sound_changed_cb)
         self._tube.watch_participants(self._participant_change_cb)
@@ -83,6 +87,8 @@ class Messenger(ExportedGObject):
                     slot.seqno = 0
                     slot.oid = i[1].id
                     slot.sender = self.me
+                for i in range(len(Document.tape)):
+                    self._slots['%s:%d' % (FRAME, i)].hold = Document.hold[i]
             else:
                 self._pong_handle = self._tube.add_signal_receiver(
                         self._pong_cb, '_pong', IFACE, path=PATH,
@@ -181,7 +187,7 @@ class Messenger(ExportedGObject):
             if cur.sender == self.me:
                 # we sent current and arrived value rewrites it
                 logger.debug('resend current with higher seqno')
-                self._send(slot, cur.oid)
+                self._send(slot, cur.oid, cur.hold)
                 return
             else:
                 logger.debug('just discard low rank')
@@ -194,21 +200,26 @@ class Messenger(ExportedGObject):
             name, raw = remote._fetch(slot, new.oid, byte_arrays=True)
             object_new(slot, new.oid, name, raw)
 
-        object_select(self._view, slot, new.oid)
+        object_select(self._view, slot, new.oid, new.hold)
         self._slots[slot] = new
 
-    def _send(self, slot_num, oid):
+    def _send(self, slot_num, oid, hold=1):
         slot = self._slots[slot_num]
         slot.seqno += 1
         slot.sender = self.me
         slot.oid = oid
+        slot.hold = hold
         self._notify(slot_num, slot.serialize())
 
         logger.debug('_send slot=%s oid=%s seqno=%d'
                 % (slot_num, oid, slot.seqno))
 
     def _frame_changed_cb(self, sender, index, frame):
-        self._send('%s:%d' % (FRAME, index), frame and frame.id)
+        self._send('%s:%d' % (FRAME, index), frame and frame.id,
+                Document.hold[index])
+
+    def _hold_changed_cb(self, sender, index, hold):
+        self._send('%s:%d' % (FRAME, index), Document.tape[index].id, hold)
 
     def _ground_changed_cb(self, sender, ground):
         self._send(GROUND, ground.id)
@@ -273,7 +284,7 @@ def object_serialize(type, oid):
         return ('', '')
 
 
-def object_select(view, type, oid):
+def object_select(view, type, oid, hold=1):
     if oid:
         object = object_find(type, oid)
     else:
@@ -285,6 +296,7 @@ def object_select(view, type, oid):
         if type.startswith(FRAME):
             index = int(type.split(':')[1])
             view.props.frame = (index, object)
+            view.set_hold(index, hold)
         elif type.startswith(GROUND):
             view.props.ground = object
         elif type.startswith(SOUND):
@@ -25,6 +25,7 @@ from gi.repository import GObject
 from gi.repository import Gdk
 from gi.repository import GdkPixbuf
 import logging
+from gettext import gettext as _
 logger = logging.getLogger('cartoon-builder')
 
 #from gobject import SIGNAL_RUN_FIRST, TYPE_PYOBJECT
@@ -32,19 +33,28 @@ logger = logging.getLogger('cartoon-builder')
 from toolkit.scrolledbox import VScrolledBox
 
 import theme
+import assets
 import char
 import ground
 import sound
-from document import Document, clean
+from document import Document, clean, playlist
 from screenbuil import Screen
+from scheduler import Scheduler, tempo_delay
+import profiler
 from utils import *
 
 logger = logging.getLogger('cartoon-builder')
 
+# how many upcoming tape frames to decode and compose during playback
+PRERENDER_COUNT = 3
+# the longest hold of tape frame in tempo ticks
+HOLD_MAX = 10
+
 
 class View(Gtk.EventBox):
     __gsignals__ = {
         'frame-changed': (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, 2 * [GObject.TYPE_PYOBJECT]),
+        'hold-changed': (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, 2 * [GObject.TYPE_PYOBJECT]),
         'ground-changed': (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, [GObject.TYPE_PYOBJECT]),
         'sound-changed': (GObject.SIGNAL_RUN_FIRST, GObject.TYPE_NONE, [GObject.TYPE_PYOBJECT])}
 
@@ -53,7 +63,11 @@ class View(Gtk.EventBox):
 
         if frame == None:
             clean(tape_num)
+            self._invalidate()
             self._tape[tape_num].get_child().set_from_pixbuf(theme.EMPTY_THUMB)
+            # clean() resets hold as well
+            if tape_num == self._tape_selected:
+                self._show_hold(1)
 
             if self._emission:
                 self.emit('frame-changed', tape_num, None)
@@ -62,6 +76,7 @@ class View(Gtk.EventBox):
                 return False
 
             Document.tape[tape_num] = frame
+            self._invalidate()
             self._tape[tape_num].get_child().set_from_pixbuf(frame.thumb())
 
             if frame.custom():
@@ -83,6 +98,20 @@ class View(Gtk.EventBox):
 
         return True
 
+    def set_hold(self, tape_num, hold):
+        """Show tape frame for hold number of tempo ticks"""
+        hold = max(1, int(hold))
+        if Document.hold[tape_num] == hold:
+            return
+        Document.hold[tape_num] = hold
+        self._invalidate()
+
+        if tape_num == self._tape_selected:
+            self._show_hold(hold)
+
+        if self._emission:
+            self.emit('hold-changed', tape_num, hold)
+
     def set_ground(self, value):
         self._set_combo(self._ground_combo, value)
 
@@ -122,42 +151,58 @@ class View(Gtk.EventBox):
 
             return combo
 
-        self.controlbox.pack_start(new_combo(char.THEMES, self._char_cb),
-                False, False, 0)
+        self._char_combo = new_combo(char.THEMES, self._char_cb)
+        self.controlbox.pack_start(self._char_combo, False, False, 0)
         self._ground_combo = new_combo(ground.THEMES, self._combo_cb,
                 Document.ground, self._ground_cb)
         self.controlbox.pack_start(self._ground_combo, False, False, 0)
         self._sound_combo = new_combo(sound.THEMES, self._combo_cb,
                 Document.sound, self._sound_cb)
         self.controlbox.pack_start(self._sound_combo, False, False, 0)
+        self.controlbox.pack_start(self._hold_box, False, False, 0)
 
         for i in range(theme.TAPE_COUNT):
             self._tape[i].get_child().set_from_pixbuf(Document.tape[i].thumb())
         self._tape_cb(None, None, 0)
 
     def play(self):
-        self._play_tape_num = 0
-        self._playing = GObject.timeout_add(self._delay, self._play_tape)
+        self._play_pos = 0
+        self._play_slot = None
+        self._scheduler.start(self._delay)
+        self._prerender()
 
     def stop(self):
-        self._playing = None
-        self._screen.fgpixbuf = Document.tape[self._tape_selected].orig()
+        self._scheduler.stop()
+        if self._prerender_id is not None:
+            GObject.source_remove(self._prerender_id)
+            self._prerender_id = None
+        self._screen.slot = None
+        self._screen.fgpixbuf = self._scaled(
+                Document.tape[self._tape_selected])
         self._screen.draw()
 
+    def get_delay(self):
+        """Tempo delay between frames in milliseconds"""
+        return self._delay
+
     def set_tempo(self, tempo):
         logger.debug('carto')
         logger.debug(tempo)
-        self._delay = 10 + (10 - int(tempo)) * 100
-        if self._playing:
-            GObject.source_remove(self._playing)
-            self._playing = GObject.timeout_add(self._delay, self._play_tape)
+        self._delay = tempo_delay(tempo)
+        self._scheduler.set_delay(self._delay)
 
     def __init__(self):
         GObject.GObject.__init__(self)
 
         self._screen = Screen()
-        self._play_tape_num = 0
-        self._playing = None
+        self._screen_width = 0
+        self._levels = {}
+        self._screen.connect('size-allocate', self._screen_allocate_cb)
+        self._play_pos = 0
+        self._play_slot = None
+        self._playlist = None
+        self._scheduler = Scheduler(self._play_tape)
+        self._prerender_id = None
         self._delay = 3 * 150
         self._tape_selected = -1
         self._tape = []
@@ -166,6 +211,11 @@ class View(Gtk.EventBox):
         self._prev_combo_selected = {}
         self._emission = True
         self._screen_size_id = None
+        self._char_combo = None
+        self._ground_combo = None
+        self._sound_combo = None
+
+        assets.LOADER.connect('loaded', self._loaded_cb)
 
         # frames table
 
@@ -247,6 +297,15 @@ class View(Gtk.EventBox):
         self.controlbox.props.border_width = theme.BORDER_WIDTH
         self.controlbox.props.spacing = theme.BORDER_WIDTH
 
+        # number of tempo ticks to show selected tape frame
+        self._hold = Gtk.SpinButton.new_with_range(1, HOLD_MAX, 1)
+        self._hold.connect('value-changed', self._hold_cb)
+        self._hold_box = Gtk.HBox()
+        self._hold_box.props.spacing = theme.BORDER_WIDTH
+        self._hold_box.pack_start(Gtk.Label(_('Hold')), False, False, 0)
+        self._hold_box.pack_start(self._hold, True, True, 0)
+        self._hold_box.show_all()
+
         leftbox = Gtk.VBox()
         logo = Gtk.Image()
         logo.set_from_file(theme.path('icons', 'logo.png'))
@@ -321,22 +380,86 @@ class View(Gtk.EventBox):
 
         combo.set_active(pos)
 
-    def _play_tape(self):
-        if not self._playing:
-            return False
-
-        self._screen.fgpixbuf = Document.tape[self._play_tape_num].orig()
+    @profiler.profile
+    def _play_tape(self, dropped):
+        if not self._scheduler.playing():
+            return 0
+
+        if self._playlist is None:
+            self._compile()
+
+        # catch up skipping entries that should have been shown already
+        hold = self._playlist[self._play_pos][1]
+        while dropped >= hold:
+            dropped -= hold
+            self._play_pos = (self._play_pos + 1) % len(self._playlist)
+            hold = self._playlist[self._play_pos][1]
+
+        tape_num = self._playlist[self._play_pos][0]
+        frame = Document.tape[tape_num]
+        if not self._screen.width or \
+                not self._screen.composed(tape_num, self._slot_key(frame)):
+            # hold current image instead of decoding on the main loop
+            self._prerender()
+            return 1
+
+        self._screen.slot = tape_num
+        self._screen.fgpixbuf = self._level(frame)
         self._screen.draw()
-
-        for i in range(theme.TAPE_COUNT):
-            self._play_tape_num += 1
-            if self._play_tape_num == TAPE_COUNT:
-                self._play_tape_num = 0
-            if Document.tape[self._play_tape_num].empty():
-                continue
-            return True
-
-        return True
+        self._scheduler.shown += 1
+        self._play_pos = (self._play_pos + 1) % len(self._playlist)
+        self._prerender()
+
+        return hold - dropped
+
+    def _invalidate(self):
+        # recompile playlist on the next use, continuing from the same slot
+        if self._playlist is not None:
+            self._play_slot = self._playlist[self._play_pos][0]
+        self._playlist = None
+
+    def _compile(self):
+        tape_num = self._play_slot
+        self._play_slot = None
+
+        self._playlist = playlist()
+        self._play_pos = 0
+        self._unpin()
+
+        # continue from the same place of the tape
+        if tape_num is not None:
+            for i, (num, hold) in enumerate(self._playlist):
+                if num <= tape_num:
+                    self._play_pos = i
+
+    def _prerender(self):
+        if self._prerender_id is None:
+            self._prerender_id = GObject.idle_add(self._prerender_cb,
+                    priority=GObject.PRIORITY_LOW)
+
+    def _prerender_cb(self):
+        # do one decode or composition per call to not delay playback ticks
+        if self._playlist is None:
+            self._compile()
+
+        size = self._screen.width
+
+        for i in range(min(PRERENDER_COUNT, len(self._playlist))):
+            if not size:
+                break
+            pos = (self._play_pos + i) % len(self._playlist)
+            tape_num = self._playlist[pos][0]
+            frame = Document.tape[tape_num]
+            if (frame, size) not in self._levels:
+                self._level(frame)
+                return True
+            key = self._slot_key(frame)
+            if not self._screen.composed(tape_num, key):
+                self._screen.compose(tape_num, self._level(frame), key)
+                return True
+
+        self._prerender_id = None
+        return False
 
     def _add_frame(self, index):
         y = index / theme.FRAME_COLS
@@ -382,9 +505,21 @@ class View(Gtk.EventBox):
                         Gdk.color_parse(BLACK))
 
         self._tape_selected = index
-        self._screen.fgpixbuf = Document.tape[index].orig()
+        self._show_hold(Document.hold[index])
+        self._screen.slot = None
+        self._screen.fgpixbuf = self._scaled(Document.tape[index])
         self._screen.draw()
 
+    def _show_hold(self, hold):
+        # do not change document if hold is out of spin button range
+        self._hold.handler_block_by_func(self._hold_cb)
+        self._hold.set_value(hold)
+        self._hold.handler_unblock_by_func(self._hold_cb)
+
+    def _hold_cb(self, widget):
+        if self._tape_selected != -1:
+            self.set_hold(self._tape_selected, widget.get_value_as_int())
+
     def _frame_cb(self, widget, event, i):
         if event.button == 3:
             self._char.clean(i)
@@ -424,9 +559,10 @@ class View(Gtk.EventBox):
         cb(choice)
 
     def _ground_cb(self, choice):
-        self._screen.bgpixbuf = choice.orig()
-        self._screen.draw()
         Document.ground = choice
+        self._unpin()
+        self._screen.bgpixbuf = self._scaled(choice)
+        self._screen.draw()
         if self._emission:
             self.emit('ground-changed', choice)
 
@@ -435,6 +571,65 @@ class View(Gtk.EventBox):
         if self._emission:
             self.emit('sound-changed', choice)
 
+    def _loaded_cb(self, loader):
+        # replace placeholders by just loaded thumbnails
+
+        def update(image, pixbuf):
+            if image.get_pixbuf() is not pixbuf:
+                image.set_from_pixbuf(pixbuf)
+
+        for combo in (self._char_combo, self._ground_combo,
+                self._sound_combo):
+            if combo is None:
+                continue
+            for row in combo.get_model():
+                if row[0] and row[2] is not row[0].thumb():
+                    row[2] = row[0].thumb()
+
+        if self._char:
+            for i, frame in enumerate(self._char.frames[:len(self._frames)]):
+                update(self._frames[i], frame.thumb())
+
+        for i in range(theme.TAPE_COUNT):
+            update(self._tape[i].get_child(), Document.tape[i].thumb())
+
+    def _scaled(self, object):
+        # screen sized level of the frame or ground, if screen is allocated
+        if not self._screen.width:
+            return object.orig()
+        return self._level(object)
+
+    def _level(self, object):
+        # screen sized levels are held here while tape or ground uses them,
+        # theme.PIXBUFS might evict them in the middle of playback
+        key = (object, self._screen.width)
+        if key not in self._levels:
+            self._levels[key] = object.scaled(self._screen.width)
+        return self._levels[key]
+
+    def _unpin(self):
+        # release levels of objects that are not used anymore
+        used = set(Document.tape)
+        used.add(Document.ground)
+        for key in self._levels.keys():
+            if key[0] not in used or key[1] != self._screen.width:
+                del self._levels[key]
+
+    def _slot_key(self, frame):
+        return (Document.ground, frame, self._screen.width)
+
+    def _screen_allocate_cb(self, screen, allocation):
+        if not self._screen.width or \
+                self._screen.width == self._screen_width:
+            return
+        self._screen_width = self._screen.width
+        self._unpin()
+        if Document.ground:
+            self._screen.bgpixbuf = self._scaled(Document.ground)
+        if self._tape_selected != -1:
+            self._screen.fgpixbuf = self._scaled(
+                    Document.tape[self._tape_selected])
+
     def _screen_size_cb(self, sender, aloc, widget):
         def set_size():
             size = min(aloc.width, aloc.height)
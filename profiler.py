@@ -0,0 +1,94 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Optional profiling of hot spots.
+
+Set CARTOON_BUILDER_PROFILE environment variable to enable profiling.
+On exit, cProfile dumps of every profiled function and a summary of
+wall-clock timings are written to tmp/ of activity root.
+"""
+
+import os
+import time
+import atexit
+import cProfile
+import logging
+from functools import wraps
+
+logger = logging.getLogger('cartoon-builder')
+
+ENABLED = bool(os.environ.get('CARTOON_BUILDER_PROFILE'))
+
+_profiles = {}
+# name -> [calls, total seconds, max seconds]
+_timings = {}
+_active = []
+
+
+def profile(func):
+    """Decorator to profile function calls if profiling is enabled"""
+    if not ENABLED:
+        return func
+
+    name = '%s.%s' % (func.__module__, func.__name__)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            if _active:
+                # only one cProfile can be enabled at once
+                return func(*args, **kwargs)
+            profile = _profiles.setdefault(name, cProfile.Profile())
+            _active.append(name)
+            try:
+                return profile.runcall(func, *args, **kwargs)
+            finally:
+                _active.pop()
+        finally:
+            seconds = time.time() - start
+            timing = _timings.setdefault(name, [0, 0., 0.])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    return wrapper
+
+
+def dump():
+    """Write collected profiles and timings summary"""
+    from sugar3.activity.activity import get_activity_root
+
+    prefix = os.path.join(get_activity_root(), 'tmp',
+            'profile-%d' % os.getpid())
+
+    for name, profile in _profiles.items():
+        profile.dump_stats('%s-%s.prof' % (prefix, name))
+
+    out = open(prefix + '.txt', 'w')
+    try:
+        out.write('%-40s %8s %10s %10s %10s\n' %
+                ('function', 'calls', 'total s', 'mean ms', 'max ms'))
+        for name, (calls, total, longest) in sorted(_timings.items()):
+            out.write('%-40s %8d %10.3f %10.3f %10.3f\n' % (name, calls,
+                    total, total * 1000 / calls, longest * 1000))
+    finally:
+        out.close()
+
+    logger.debug('profiles were written to %s*' % prefix)
+
+
+if ENABLED:
+    atexit.register(dump)
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Render saved cartoon bundles without running the activity.
+
+Usage:
+
+    python render.py [--format gif|ogg|webm|png] [--output DIR] \\
+            [--tempo 0..10] [--size PIXELS] [--jobs N] bundle...
+
+Bundles are rendered in a process pool, one worker per core by default,
+and per-file timing report, with encoding fps for video formats, is printed
+at the end.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import traceback
+import multiprocessing
+
+BUNDLE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+FORMATS = ['gif', 'ogg', 'webm', 'png']
+
+
+def _init(tmp_dir):
+    # every worker gets its own activity root to not share session files
+    os.environ.setdefault('SUGAR_BUNDLE_PATH', BUNDLE_PATH)
+    root = tempfile.mkdtemp(dir=tmp_dir)
+    os.mkdir(os.path.join(root, 'tmp'))
+    os.environ['SUGAR_ACTIVITY_ROOT'] = root
+    sys.path.insert(0, BUNDLE_PATH)
+
+
+def _render(args):
+    bundle, output, format, delay, size = args
+
+    import document
+    import export
+
+    start = time.time()
+    fps = None
+    try:
+        document.reset()
+        if not document.load(bundle):
+            raise RuntimeError('cannot load bundle')
+        if format == 'gif':
+            export.gif(output, delay, size)
+        elif format == 'png':
+            export.png(output, size)
+        else:
+            fps = export.video(output, delay, size, format)
+        error = None
+    except Exception, e:
+        error = str(e) or traceback.format_exc()
+
+    return bundle, output, time.time() - start, fps, error
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+            description='Render saved Cartoon Builder bundles')
+    parser.add_argument('bundles', metavar='bundle', nargs='+')
+    parser.add_argument('-f', '--format', choices=FORMATS, default='gif')
+    parser.add_argument('-o', '--output', default='.',
+            help='directory to write rendered files to')
+    parser.add_argument('-t', '--tempo', type=int, default=5)
+    parser.add_argument('-s', '--size', type=int, default=360)
+    parser.add_argument('-j', '--jobs', type=int,
+            default=multiprocessing.cpu_count())
+    args = parser.parse_args(argv)
+
+    from scheduler import tempo_delay
+    delay = tempo_delay(args.tempo)
+
+    tasks = []
+    for bundle in args.bundles:
+        name = os.path.splitext(os.path.basename(bundle))[0]
+        if args.format != 'png':
+            name += '.' + args.format
+        tasks.append((os.path.abspath(bundle),
+                os.path.join(args.output, name), args.format, delay,
+                args.size))
+
+    start = time.time()
+    tmp_dir = tempfile.mkdtemp(prefix='cartoon-builder-')
+    pool = multiprocessing.Pool(args.jobs, _init, (tmp_dir,))
+    failed = 0
+    spent = 0
+
+    try:
+        for bundle, output, seconds, fps, error in \
+                pool.imap_unordered(_render, tasks):
+            spent += seconds
+            if error:
+                failed += 1
+                sys.stdout.write('%8.2fs  FAILED  %s: %s\n' %
+                        (seconds, bundle, error))
+            elif fps is not None:
+                sys.stdout.write('%8.2fs  %6.1f fps  %s\n' %
+                        (seconds, fps, output))
+            else:
+                sys.stdout.write('%8.2fs  %s\n' % (seconds, output))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    elapsed = time.time() - start
+    sys.stdout.write('%d bundles, %d failed, %d workers: %.2fs wall, '
+            '%.2fs rendering, %.2fs per bundle\n' % (len(tasks), failed,
+            args.jobs, elapsed, spent, spent / max(len(tasks), 1)))
+
+    return failed and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,98 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+from gi.repository import GLib
+from gi.repository import GObject
+import logging
+logger = logging.getLogger('cartoon-builder')
+
+
+def tempo_delay(tempo):
+    """Convert tempo slider value to delay between frames in milliseconds"""
+    return 10 + (10 - int(tempo)) * 100
+
+
+class Scheduler:
+    """
+    Invoke callback on multiples of fixed delay without accumulating drift.
+
+    Due time of every tick is computed from monotonic clock, so draw time
+    and main loop jitter don't slow down playback. If scheduler is behind,
+    callback gets number of dropped delays to catch up by skipping frames.
+    Callback returns number of delays to wait before next invocation and
+    increments shown when it actually showed a frame, e.g., it might wait
+    for frame to be prepared instead.
+
+        scheduler = Scheduler(cb)   # cb(dropped) returns 0 to stop
+        scheduler.start(delay)      # delay in milliseconds
+    """
+
+    def __init__(self, cb):
+        self._cb = cb
+        self._delay = 0
+        self._due = 0
+        self._source = None
+        self.shown = 0
+        self.dropped = 0
+
+    def playing(self):
+        return self._source is not None
+
+    def start(self, delay):
+        self.stop()
+        self.shown = 0
+        self.dropped = 0
+        self._delay = delay * 1000
+        self._due = GLib.get_monotonic_time() + self._delay
+        self._schedule()
+
+    def stop(self):
+        if self._source is None:
+            return
+        GObject.source_remove(self._source)
+        self._source = None
+        logger.debug('scheduler stopped shown=%d dropped=%d'
+                % (self.shown, self.dropped))
+
+    def set_delay(self, delay):
+        delay *= 1000
+
+        if self._source is not None:
+            # keep the phase, i.e. the passed part of current interval
+            now = GLib.get_monotonic_time()
+            remaining = max(0, self._due - now)
+            self._due = now + remaining * delay / self._delay
+            GObject.source_remove(self._source)
+            self._delay = delay
+            self._schedule()
+        else:
+            self._delay = delay
+
+    def _schedule(self):
+        timeout = max(0, self._due - GLib.get_monotonic_time())
+        self._source = GObject.timeout_add(int(timeout / 1000), self._tick)
+
+    def _tick(self):
+        dropped = max(0, (GLib.get_monotonic_time() - self._due) / self._delay)
+        self._due += dropped * self._delay
+        self.dropped += dropped
+
+        delays = self._cb(dropped)
+        if delays:
+            self._due += delays * self._delay
+            self._schedule()
+        else:
+            self._source = None
+
+        return False
@@ -21,12 +21,17 @@
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk
-from gi.repository import Gdk
 from gi.repository import GdkPixbuf
 import cairo
 import logging
 logger = logging.getLogger('cartoon-builder')
+from sugar3.util import LRU
+from toolkit import pixbuf as _pixbuf
 import theme
+import profiler
+
+# enough to keep the ground and every tape frame converted during playback
+SURFACE_CACHE_SIZE = theme.TAPE_COUNT + 2
 
 class Screen(Gtk.DrawingArea):
     def __init__(self):
@@ -36,46 +41,89 @@ class Screen(Gtk.DrawingArea):
         self.height = 0 # idem
         self.bgpixbuf = None
         self.fgpixbuf = None
+        self.slot = None # tape slot to show pre-composited, None while editing
+        self._surfaces = LRU(SURFACE_CACHE_SIZE)
+        self._slots = {}
         self.connect('size-allocate', self.on_size_allocate)
         self.connect('draw',  self.on_draw_cb)
         self.connect('realize',       self.on_realize)
 
     def on_realize(self, widget):
-        #self.cr = widget.window.new_gc()
-        pass
+        # rebuild surfaces compatible with the just created window
+        self._surfaces = LRU(SURFACE_CACHE_SIZE)
+        self._slots = {}
 
     def on_size_allocate(self, widget, allocation):
-        self.height = self.width = min(allocation.width, allocation.height)
+        size = min(allocation.width, allocation.height)
+        if size != self.width:
+            self._surfaces = LRU(SURFACE_CACHE_SIZE)
+            self._slots = {}
+        self.height = self.width = size
         logger.debug('pixmap')
         logger.debug(self.height)
 
-    
+
+    @profiler.profile
     def on_draw_cb(self, widget, cr):
         # This is where the drawing takes place
-        if self.bgpixbuf:
-            pixbuf = self.bgpixbuf
-            if pixbuf.get_width != self.width:
-                pixbuf = theme.scale(pixbuf, self.width)
-            logger.debug('cairo')
-            logger.debug(pixbuf)
-            logger.debug(cr)
-            #widget.window.draw_pixbuf(self.gc, pixbuf, 0, 0, 0, 0, -1, -1, 0, 0)
-            Gdk.cairo_set_source_pixbuf(cr, pixbuf, 0, 0)
-            cr.rectangle(0, 0, -1, -1)
+        if self.slot in self._slots and self.width:
+            cr.set_source_surface(self._slots[self.slot][1], 0, 0)
             cr.paint()
+            return
+
+        for pixbuf in (self.bgpixbuf, self.fgpixbuf):
+            if not pixbuf:
+                continue
+            cr.set_source_surface(self._surface(pixbuf), 0, 0)
+            cr.paint()
+
+    def composed(self, slot, key):
+        """
+        Is there up-to-date pre-composited surface for tape slot.
 
+        key identifies ground and frame content, e.g. assets and their size,
+        to not depend on identity of pixbufs that might be rescaled.
+        """
+        return slot in self._slots and self._slots[slot][0] == key
 
-        if self.fgpixbuf:
-            pixbuf = self.fgpixbuf
-            if pixbuf.get_width != self.width:
-                pixbuf = theme.scale(pixbuf, self.width)
-            logger.debug('cairo1')
-            logger.debug(pixbuf)
-            logger.debug(cr)
-            #widget.window.draw_pixbuf(self.gc, pixbuf, 0, 0, 0, 0, -1, -1, 0, 0)
-            Gdk.cairo_set_source_pixbuf(cr, pixbuf, 0, 0)
-            cr.rectangle(0, 0, -1, -1)
+    def compose(self, slot, fgpixbuf, key):
+        """Return pre-composited ground and fgpixbuf surface for tape slot"""
+        if self.composed(slot, key):
+            return self._slots[slot][1]
+
+        window = self.get_window()
+        if window:
+            surface = window.create_similar_image_surface(cairo.FORMAT_ARGB32,
+                    self.width, self.height, 1)
+        else:
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                    self.width, self.height)
+        cr = cairo.Context(surface)
+        for pixbuf in (self.bgpixbuf, fgpixbuf):
+            if not pixbuf:
+                continue
+            cr.set_source_surface(self._surface(pixbuf), 0, 0)
             cr.paint()
+        self._slots[slot] = (key, surface)
+
+        return surface
+
+    def _surface(self, pixbuf):
+        # key by identity, keep source in value to not be fooled by id reuse
+        key = (id(pixbuf), self.width)
+        if key in self._surfaces:
+            source, surface = self._surfaces[key]
+            if source is pixbuf:
+                return surface
+
+        scaled = pixbuf
+        if pixbuf.get_width() != self.width or \
+                pixbuf.get_height() != self.height:
+            scaled = theme.scale(pixbuf, self.width)
+        surface = _pixbuf.to_surface(scaled, self.get_window())
+        self._surfaces[key] = (pixbuf, surface)
+
+        return surface
 
     def draw(self):
         self.queue_draw()
@@ -14,5 +14,15 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import os
+import sys
+import catalog
 from sugar3.activity import bundlebuilder
+
+# ship assets index to not scan bundle on the first run
+try:
+    catalog.write(os.path.dirname(os.path.abspath(__file__)))
+except (IOError, OSError), e:
+    sys.stderr.write('Cannot update %s: %s\n' % (catalog.FILENAME, e))
+
 bundlebuilder.start()
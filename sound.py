@@ -12,12 +12,10 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-import os
 import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('Gst', '1.0')
 from gi.repository import Gst
-Gst.init(None)
 from gi.repository import Gtk
 import shutil
 from glob import glob
@@ -26,6 +24,7 @@ from gettext import gettext as _
 import toolkit.chooser as chooser
 
 import theme
+import assets
 from utils import *
 from sugar3.activity.activity import get_bundle_path
 
@@ -45,7 +44,8 @@ class Sound:
         self.name = name
         self.id = id
         self._soundfile = soundfile
-        self._thumb = theme.pixbuf(thumb, theme.THUMB_SIZE)
+        self._thumbfile = thumb
+        self._thumb = None
 
     def custom(self):
         return True
@@ -54,16 +54,28 @@ class Sound:
         return file(self._soundfile, 'r').read()
 
     def thumb(self):
-        return self._thumb
+        if self._thumb is None:
+            self._thumb = assets.LOADER.submit(theme.thumb, self._thumbfile)
+        return assets.get(self._thumb, theme.EMPTY_THUMB)
+
+    def path(self):
+        """Return path to sound file to not read it to memory at once"""
+        if not self._soundfile:
+            return None
+        return theme.path(self._soundfile)
+
+    def uri(self):
+        if not self._soundfile:
+            return None
+        return 'file://' + self.path()
 
     def select(self):
         if Sound.current != self:
             Sound.current = self
-            Sound.player.set_state(Gst.State.NULL)
-            Sound.player.set_property('uri',
-                    'file://' + theme.path(self._soundfile))
+            get_player().set_state(Gst.State.NULL)
+            get_player().set_property('uri', self.uri())
         if Sound.playing:
-            Sound.player.set_state(Gst.State.PLAYING)
+            get_player().set_state(Gst.State.PLAYING)
         return self
 
 class PreinstalledSound(Sound):
@@ -85,7 +97,7 @@ class MuteSound(Sound):
 
     def select(self):
         Sound.current = self
-        Sound.player.set_state(Gst.State.PAUSED)
+        get_player().set_state(Gst.State.PAUSED)
         return self
 
 class CustomSound(Sound):
@@ -101,13 +113,27 @@ class CustomSound(Sound):
 
 class RestoredSound(Sound):
     def __init__(self, name, id, data):
-        soundfile = os.path.join(theme.SESSION_PATH, id)
+        soundfile = theme.session_path(id)
         Sound.__init__(self, name, id, soundfile, theme.SOUND_CUSTOM)
-        file(soundfile, 'w').write(data)
+        # content or function to read it, written to soundfile on first use
+        self._data = data
+
+    def path(self):
+        if self._data is not None:
+            data = self._data
+            if callable(data):
+                data = data()
+            file(self._soundfile, 'w').write(data)
+            self._data = None
+        return Sound.path(self)
+
+    def serialize(self):
+        self.path()
+        return Sound.serialize(self)
 
 class JournalSound(Sound):
     def __init__(self, jobject):
-        soundfile = os.path.join(theme.SESSION_PATH, jobject.object_id)
+        soundfile = theme.session_path(jobject.object_id)
         Sound.__init__(self, jobject.metadata['title'],
                 jobject.object_id, soundfile, theme.SOUND_CUSTOM)
         shutil.copy(jobject.file_path, soundfile) 
@@ -128,10 +154,23 @@ def play():
 
 def stop():
     Sound.playing = False
-    Sound.player.set_state(Gst.State.PAUSED)
+    get_player().set_state(Gst.State.PAUSED)
 
 # GSTREAMER STUFF
 
+def get_player():
+    """Return playbin to play sounds, GStreamer is initialized on first call"""
+    if Sound.player is None:
+        Gst.init(None)
+        Sound.player = _playbin('player')
+
+        bus = Sound.player.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message::eos', _reload_cb)
+        bus.connect('message::error', _error_cb)
+
+    return Sound.player
+
 def _reload_cb(bus, message):
     Sound.player.set_state(Gst.State.READY)
     Sound.player.set_state(Gst.State.PLAYING)
@@ -139,11 +178,32 @@ def _reload_cb(bus, message):
 def _error_cb(bus, message):
     Sound.player.set_state(Gst.State.NULL)
 
-Sound.player = Gst.ElementFactory.make("playbin", "player")
-fakesink = Gst.ElementFactory.make('fakesink', "my-fakesink")
-Sound.player.set_property("video-sink", fakesink)
-
-bus = Sound.player.get_bus()
-bus.add_signal_watch()
-bus.connect('message::eos', _reload_cb)
-bus.connect('message::error', _error_cb)
+def _playbin(name):
+    player = Gst.ElementFactory.make("playbin", name)
+    fakesink = Gst.ElementFactory.make('fakesink', "%s-fakesink" % name)
+    player.set_property("video-sink", fakesink)
+    return player
+
+def decode(uri, filepath, caps):
+    """
+    Decode sound from uri to raw file in format of caps string.
+
+    Function is synchronous and doesn't need running main loop.
+    """
+    Gst.init(None)
+    player = _playbin('decoder')
+    sink = Gst.parse_bin_from_description('audioconvert ! audioresample ! '
+            '%s ! filesink location="%s"' % (caps, filepath), True)
+    player.set_property('audio-sink', sink)
+    player.set_property('uri', uri)
+
+    try:
+        player.set_state(Gst.State.PLAYING)
+        message = player.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE,
+                Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    finally:
+        player.set_state(Gst.State.NULL)
+
+    if message.type == Gst.MessageType.ERROR:
+        raise RuntimeError('Cannot decode %s: %s' % \
+                (uri, message.parse_error()[0].message))
@@ -18,12 +18,24 @@ gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk
 from gi.repository import Gdk
 from gi.repository import GdkPixbuf
+from gi.repository import GLib
 import shutil
+import tempfile
+import struct
+import hashlib
+import logging
+import threading
 from math import ceil
+from collections import OrderedDict
 
 from sugar3.activity.activity import get_bundle_path, get_activity_root
 from sugar3.graphics import style
 
+from toolkit import pixbuf as _pixbuf
+import catalog
+
+logger = logging.getLogger('cartoon-builder')
+
 SOUND_SPEAKER = 'images/sounds/speaker.png'
 SOUND_MUTE    = 'images/sounds/mute.png'
 SOUND_CUSTOM  = 'images/sounds/custom.png'
@@ -32,8 +44,13 @@ LOGO_WIDTH = style.zoom(275)
 TAPE_COUNT = 11
 FRAME_COUNT = 14
 
-DESKTOP_WIDTH = Gdk.Screen.width()
-DESKTOP_HEIGHT = Gdk.Screen.height() - style.LARGE_ICON_SIZE
+if Gdk.Screen.get_default() is not None:
+    DESKTOP_WIDTH = Gdk.Screen.width()
+    DESKTOP_HEIGHT = Gdk.Screen.height() - style.LARGE_ICON_SIZE
+else:
+    # headless run, e.g. exporting, assume XO screen
+    DESKTOP_WIDTH = 1200
+    DESKTOP_HEIGHT = 900 - style.LARGE_ICON_SIZE
 
 THUMB_SIZE = style.zoom(min(100, DESKTOP_WIDTH / (TAPE_COUNT+1)))
 
@@ -46,6 +63,13 @@ FRAME_ROWS = max((DESKTOP_HEIGHT - THUMB_SIZE*3) / THUMB_SIZE,
 
 BORDER_WIDTH = style.zoom(10)
 
+# bytes of pixel data to keep decoded preinstalled images in memory, on top
+# of screen sized levels of the ground and every tape frame
+PIXBUF_CACHE_SIZE = 4 * 1024 * 1024 + \
+        DESKTOP_HEIGHT * DESKTOP_HEIGHT * 4 * (TAPE_COUNT + 1)
+# bytes to keep GIF images as palette plus indices out of PIXBUF_CACHE_SIZE
+INDEXED_CACHE_SIZE = 8 * 1024 * 1024
+
 # Colors from the Rich's UI design
 
 GRAY = "#B7B7B7" # gray
@@ -78,10 +102,20 @@ OLD_COLOR_BG_BUTTONS = (
     (Gtk.StateType.INSENSITIVE,"#027F01"),
     )
 
+THUMBS_PATH = os.path.join(get_activity_root(), 'data', 'thumbs')
+
 SESSION_PATH = os.path.join(get_activity_root(), 'tmp', '.session')
-if os.path.isdir(SESSION_PATH):
-    shutil.rmtree(SESSION_PATH)
-os.mkdir(SESSION_PATH)
+_session_clean = False
+
+def session_path(*args):
+    """Return path in session directory, it is cleaned up on first call"""
+    global _session_clean
+    if not _session_clean:
+        if os.path.isdir(SESSION_PATH):
+            shutil.rmtree(SESSION_PATH)
+        os.mkdir(SESSION_PATH)
+        _session_clean = True
+    return os.path.join(SESSION_PATH, *args)
 
 def path(*args):
     file = os.path.join(*args)
@@ -101,16 +135,244 @@ def pixbuf(file, size = None):
 def scale(pixbuf, size = THUMB_SIZE):
     return pixbuf.scale_simple(size, size, GdkPixbuf.InterpType.BILINEAR)
 
+PIXBUFS = _pixbuf.Cache(PIXBUF_CACHE_SIZE)
+
+if _pixbuf.numpy is not None:
+    INDEXED = _pixbuf.Cache(INDEXED_CACHE_SIZE, sizeof=len)
+else:
+    INDEXED = None
+
+def orig(file):
+    """
+    Return full sized pixbuf for image file, it might be evicted later.
+
+    Palette images are kept in INDEXED and expanded to RGBA on every call,
+    only levels scaled from them take PIXBUFS budget.
+    """
+    indexed = _indexed(file)
+    if indexed is not None:
+        return indexed.expand()
+    return PIXBUFS.get(('orig', file), lambda: pixbuf(file))
+
+# palette images with too many colors to index them
+_not_indexed = set()
+
+def _indexed(file):
+    if INDEXED is None or file in _not_indexed or \
+            not file.lower().endswith('.gif'):
+        return None
+    try:
+        return INDEXED.get(file, lambda: _pixbuf.Indexed(pixbuf(file)))
+    except ValueError:
+        _not_indexed.add(file)
+        return None
+
+# sizes levels were requested for, to look up the nearest larger one
+_level_sizes = {}
+
+def level(key, size, load):
+    """
+    Return pixbuf of image identified by key scaled to size.
+
+    Every level is scaled once from the nearest larger level that is still
+    cached; load(size) is called otherwise and should return either ready
+    level or the original image.
+    """
+    def create():
+        source = None
+        for i in sorted(_level_sizes.keys()):
+            if i > size:
+                source = PIXBUFS.peek(('level', key, i))
+                if source is not None:
+                    break
+        if source is None:
+            source = load(size)
+        if max(source.get_width(), source.get_height()) == size:
+            return source
+        return scale(source, size)
+
+    _level_sizes[size] = True
+    return PIXBUFS.get(('level', key, size), create)
+
+def scaled(file, size):
+    """Return pixbuf for image file scaled to size, see level()"""
+    def load(size):
+        if size == THUMB_SIZE:
+            return _load_thumb(file)
+        return orig(file)
+    return level(file, size, load)
+
+class Levels:
+    """
+    Scaled copies of image which is not a preinstalled file.
+
+    Unlike level(), levels are kept by the image owner, e.g. custom or
+    restored frame, and freed along with it instead of pinning original
+    image by PIXBUFS key. Only count recently used sizes are kept.
+    """
+
+    def __init__(self, count=3):
+        self._count = count
+        self._orig = None
+        self._levels = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, orig, size):
+        with self._lock:
+            if orig is not self._orig:
+                # image was changed, e.g., picked from Journal
+                self._orig = orig
+                self._levels.clear()
+            out = self._levels.pop(size, None)
+
+        if out is None:
+            if max(orig.get_width(), orig.get_height()) == size:
+                out = orig
+            else:
+                out = scale(orig, size)
+
+        with self._lock:
+            if orig is self._orig:
+                self._levels[size] = out
+                while len(self._levels) > self._count:
+                    self._levels.popitem(last=False)
+
+        return out
+
+# magic, width, height, rowstride, has_alpha
+_THUMB_HEADER = struct.Struct('<4sIIIB')
+_THUMB_MAGIC = 'CBT1'
+
+def thumb(file):
+    """
+    Return THUMB_SIZE pixbuf for image file.
+
+    Thumbnails are cached on disk as raw pixels, so warm start doesn't need
+    to decode and resample source image.
+    """
+    return scaled(file, THUMB_SIZE)
+
+def _thumb_key(filepath):
+    stat = os.stat(filepath)
+    return hashlib.sha1('%s:%d:%d:%d' % (filepath, stat.st_mtime,
+            stat.st_size, THUMB_SIZE)).hexdigest()
+
+_thumbs_purged = False
+_thumbs_lock = threading.Lock()
+
+def _purge_thumbs():
+    """Remove cached thumbnails left from previous bundle once upgraded"""
+    # activity.info is replaced on every bundle upgrade
+    stamp = str(os.stat(path('activity', 'activity.info')).st_mtime)
+    stamp_path = os.path.join(THUMBS_PATH, '.purged')
+    if not os.path.isdir(THUMBS_PATH) or os.path.exists(stamp_path) and \
+            open(stamp_path).read() == stamp:
+        return
+
+    keep = set()
+    for dir in catalog.DIRS:
+        for file in catalog.listdir(dir):
+            keep.add(_thumb_key(path(file)))
+
+    for name in os.listdir(THUMBS_PATH):
+        if name not in keep:
+            os.unlink(os.path.join(THUMBS_PATH, name))
+    logger.debug('purged cached thumbnails in %s' % THUMBS_PATH)
+
+    out = open(stamp_path, 'w')
+    try:
+        out.write(stamp)
+    finally:
+        out.close()
+
+def _load_thumb(file):
+    global _thumbs_purged
+    if not _thumbs_purged:
+        # loader threads should not write thumbnails while purging
+        with _thumbs_lock:
+            if not _thumbs_purged:
+                try:
+                    _purge_thumbs()
+                except Exception, e:
+                    logger.warning('Cannot purge cached thumbnails: %s' % e)
+                _thumbs_purged = True
+
+    filepath = path(file)
+    cache_path = os.path.join(THUMBS_PATH, _thumb_key(filepath))
+
+    out = None
+    if os.path.exists(cache_path):
+        try:
+            out = _read_thumb(cache_path)
+        except Exception, e:
+            logger.warning('Cannot read cached thumbnail for %s: %s' % \
+                    (file, e))
+    if out is None:
+        out = pixbuf(file, THUMB_SIZE)
+        try:
+            _write_thumb(cache_path, out)
+        except Exception, e:
+            logger.warning('Cannot cache thumbnail for %s: %s' % (file, e))
+
+    return out
+
+def _read_thumb(cache_path):
+    mapped = GLib.MappedFile.new(cache_path, False)
+    f = open(cache_path, 'rb')
+    try:
+        header = f.read(_THUMB_HEADER.size)
+    finally:
+        f.close()
+    if len(header) != _THUMB_HEADER.size:
+        return None
+    magic, width, height, rowstride, has_alpha = _THUMB_HEADER.unpack(header)
+    if magic != _THUMB_MAGIC or \
+            mapped.get_length() != _THUMB_HEADER.size + height * rowstride:
+        return None
+    # pixbuf references mapped pixels, the mapping lives while pixbuf does
+    pixels = GLib.Bytes.new_from_bytes(mapped.get_bytes(),
+            _THUMB_HEADER.size, height * rowstride)
+    return GdkPixbuf.Pixbuf.new_from_bytes(pixels,
+            GdkPixbuf.Colorspace.RGB, bool(has_alpha), 8, width, height,
+            rowstride)
+
+def _write_thumb(cache_path, pixbuf):
+    if not os.path.isdir(THUMBS_PATH):
+        try:
+            os.makedirs(THUMBS_PATH)
+        except OSError:
+            # might be created by another loader thread
+            if not os.path.isdir(THUMBS_PATH):
+                raise
+
+    height = pixbuf.get_height()
+    rowstride = pixbuf.get_rowstride()
+    pixels = pixbuf.get_pixels()
+    # last row of pixbuf might be not padded up to rowstride
+    pixels += '\0' * (height * rowstride - len(pixels))
+
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=THUMBS_PATH)
+    f = os.fdopen(tmp_fd, 'wb')
+    try:
+        f.write(_THUMB_HEADER.pack(_THUMB_MAGIC, pixbuf.get_width(), height,
+                rowstride, pixbuf.get_has_alpha()))
+        f.write(pixels)
+    finally:
+        f.close()
+    os.rename(tmp_path, cache_path)
+
 EMPTY_FILENAME = 'images/pics/empty.png'
 EMPTY_ORIG = pixbuf(EMPTY_FILENAME)
-EMPTY_THUMB = scale(EMPTY_ORIG)
+EMPTY_THUMB = thumb(EMPTY_FILENAME)
 
 CUSTOM_FRAME_ORIG = pixbuf('images/pics/custom.png')
-CUSTOM_FRAME_THUMB = scale(CUSTOM_FRAME_ORIG)
-
-# customize theme
-gtkrc = os.path.join(get_bundle_path(), 'gtkrc')
-Gtk.rc_add_default_file(gtkrc)
-settings = Gtk.Settings.get_default()
-Gtk.rc_reset_styles(settings)
-Gtk.rc_reparse_all_for_settings(settings, True)
+CUSTOM_FRAME_THUMB = thumb('images/pics/custom.png')
+
+def init_style():
+    """Customize theme, should be called when activity window is mapped"""
+    gtkrc = os.path.join(get_bundle_path(), 'gtkrc')
+    Gtk.rc_add_default_file(gtkrc)
+    settings = Gtk.Settings.get_default()
+    if settings is not None:
+        Gtk.rc_reset_styles(settings)
+        Gtk.rc_reparse_all_for_settings(settings, True)
@@ -18,11 +18,14 @@
 
 import re
 import cStringIO
+import threading
+from collections import OrderedDict
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk
 from gi.repository import GdkPixbuf
 from gi.repository import Gdk
+from gi.repository import GLib
 gi.require_version('Rsvg', '2.0')
 from gi.repository import Rsvg
 import cairo
@@ -32,6 +35,116 @@ from sugar3.graphics import style
 from sugar3.graphics.xocolor import XoColor
 from sugar3.util import LRU
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Cache:
+    """
+    Thread-safe LRU cache of pixbufs limited by size of pixel data.
+
+    Usage:
+
+        cache = Cache(4 * 1024 * 1024)
+        pixbuf = cache.get(key, lambda: GdkPixbuf.Pixbuf.new_from_file(path))
+
+    sizeof(value) should return number of bytes value takes, pixel data of
+    pixbuf by default.
+    """
+
+    def __init__(self, budget, sizeof=None):
+        self.budget = budget
+        self.size = 0
+        self._sizeof = sizeof or _sizeof
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def peek(self, key):
+        """Return cached pixbuf or None, do not touch the LRU order"""
+        with self._lock:
+            return self._items.get(key)
+
+    def get(self, key, load):
+        """Return cached pixbuf, call load() to create it on cache miss"""
+        with self._lock:
+            if key in self._items:
+                pixbuf = self._items.pop(key)
+                self._items[key] = pixbuf
+                return pixbuf
+
+        pixbuf = load()
+
+        with self._lock:
+            if key in self._items:
+                # was loaded by another thread meanwhile
+                return self._items[key]
+            self._items[key] = pixbuf
+            self.size += self._sizeof(pixbuf)
+            while self.size > self.budget and len(self._items) > 1:
+                __, evicted = self._items.popitem(last=False)
+                self.size -= self._sizeof(evicted)
+
+        return pixbuf
+
+
+def _sizeof(pixbuf):
+    return pixbuf.get_rowstride() * pixbuf.get_height()
+
+
+class Indexed:
+    """
+    Pixbuf stored as palette plus 8-bit indices, requires numpy.
+
+    Images with up to 256 colors, e.g. decoded GIFs, take about quarter of
+    RGBA pixbuf memory this way; expand() restores pixbuf when pixels are
+    needed. ValueError is raised if pixbuf has more than 256 colors.
+    """
+
+    def __init__(self, pixbuf):
+        self.width = pixbuf.get_width()
+        self.height = pixbuf.get_height()
+        self.has_alpha = pixbuf.get_has_alpha()
+        channels = pixbuf.get_n_channels()
+        rowstride = pixbuf.get_rowstride()
+
+        pixels = pixbuf.get_pixels()
+        # last row of pixbuf might be not padded up to rowstride
+        pixels += '\0' * (self.height * rowstride - len(pixels))
+        pixels = numpy.frombuffer(pixels, dtype=numpy.uint8)
+        pixels = pixels.reshape(self.height, rowstride)
+        pixels = pixels[:, :self.width * channels]
+        pixels = pixels.reshape(self.width * self.height, channels)
+
+        # pack every pixel into one integer to find unique colors
+        colors = numpy.zeros(len(pixels), dtype=numpy.uint32)
+        for i in range(channels):
+            colors |= pixels[:, i].astype(numpy.uint32) << (i * 8)
+        palette, indices = numpy.unique(colors, return_inverse=True)
+        if len(palette) > 256:
+            raise ValueError('Too many colors to index: %d' % len(palette))
+
+        self._palette = numpy.column_stack(
+                [(palette >> (i * 8)) & 0xff for i in range(channels)]) \
+                .astype(numpy.uint8)
+        self._indices = indices.astype(numpy.uint8)
+
+    def __len__(self):
+        return self._palette.nbytes + self._indices.nbytes
+
+    def expand(self):
+        """Return new RGB(A) pixbuf"""
+        pixels = self._palette[self._indices]
+        return GdkPixbuf.Pixbuf.new_from_bytes(
+                GLib.Bytes.new(pixels.tostring()), GdkPixbuf.Colorspace.RGB,
+                self.has_alpha, 8, self.width, self.height,
+                self.width * pixels.shape[1])
+
 
 def to_file(pixbuf):
     """Convert pixbuf object to file object"""
@@ -49,22 +162,59 @@ def to_str(pixbuf):
     """Convert pixbuf object to string"""
     return to_file(pixbuf).getvalue()
 
+_PNG_MAGIC = '\x89PNG\r\n\x1a\n'
+
+def read_png(path):
+    """Return content of PNG file to pass it as is, None for other formats"""
+    f = open(path, 'rb')
+    try:
+        if f.read(len(_PNG_MAGIC)) != _PNG_MAGIC:
+            return None
+        f.seek(0)
+        return f.read()
+    finally:
+        f.close()
+
 def from_str(str):
-    """Convert string to pixbuf object"""
+    """Convert string to pixbuf object, None if it cannot be decoded"""
 
     loader = GdkPixbuf.PixbufLoader.new_with_mime_type('image/png')
 
     try:
-        loader.write(str)
+        try:
+            loader.write(str)
+        finally:
+            # raises on truncated data as well
+            loader.close()
     except Exception, e:
         logging.error('pixbuf.from_str: %s' % e)
         return None
-    finally:
-        loader.close()
 
     return loader.get_pixbuf()
 
 
+def to_surface(pixbuf, window=None):
+    """Convert pixbuf object to cairo surface
+
+    If window is given, surface will be compatible with window's device
+    and can be painted without further conversions.
+    """
+    width = pixbuf.get_width()
+    height = pixbuf.get_height()
+
+    if window:
+        surface = window.create_similar_image_surface(cairo.FORMAT_ARGB32,
+                width, height, 1)
+    else:
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+
+    context = cairo.Context(surface)
+    Gdk.cairo_set_source_pixbuf(context, pixbuf, 0, 0)
+    context.paint()
+
+    return surface
+
+
 def at_size_with_ratio(pixbuf, width, height, type=GdkPixbuf.InterpType.BILINEAR):
     image_width = pixbuf.get_width()
     image_height = pixbuf.get_height()
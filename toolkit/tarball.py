@@ -17,14 +17,12 @@
 """Simplify tarfile module usage"""
 import gi
 gi.require_version('Gtk', '3.0')
-import os
 import time
 import tarfile
+import threading
 import cStringIO
 from gi.repository import Gtk
 import zipfile
-import tempfile
-import shutil
 
 
 class TarballError(Exception):
@@ -52,6 +50,10 @@ class Tarball:
         # write string to file in tarball
         tar.write('name within tarball', 'string to write')
 
+        # copy file or seekable file object by chunks
+        tar.write_file('name within tarball', 'path/to/file')
+        tar.write('name within tarball', file_object)
+
         # save and close tarball file
         tar.close()
 
@@ -65,31 +67,18 @@ class Tarball:
     """
 
     def __init__(self, name=None, mode='r', mtime=None):
-        if not mode.startswith('r') or tarfile.is_tarfile(name):
+        self.__tar = None
+        self.__reader = None
+        self.__lock = threading.Lock()
+
+        if not mode.startswith('r'):
             self.__tar = tarfile.TarFile(name=name, mode=mode)
+        elif tarfile.is_tarfile(name):
+            self.__reader = _TarReader(name)
+        elif zipfile.is_zipfile(name):
+            self.__reader = _ZipReader(name)
         else:
-            # convert for tar
-
-            if not zipfile.is_zipfile(name):
-                raise tarfile.ReadError()
-
-            try:
-                tmp_dir = tempfile.mkdtemp()
-                tmp_fd, tmp_name = tempfile.mkstemp()
-                tmp_fo = os.fdopen(tmp_fd, 'w')
-
-                zip = zipfile.ZipFile(name)
-                zip.extractall(tmp_dir)
-
-                tar = tarfile.TarFile(fileobj=tmp_fo, mode='w')
-                tar.add(tmp_dir, arcname='')
-                tar.close()
-
-                self.__tar = tarfile.TarFile(name=tmp_name, mode=mode)
-            finally:
-                tmp_fo.close()
-                os.unlink(tmp_name)
-                shutil.rmtree(tmp_dir)
+            raise tarfile.ReadError()
 
         if mtime:
             self.mtime = mtime
@@ -98,29 +87,113 @@ class Tarball:
 
     def close(self):
         """Save(if 'r' mode was given) and close tarball file."""
-        self.__tar.close()
+        if self.__reader is not None:
+            self.__reader.close()
+        else:
+            self.__tar.close()
 
     def getnames(self):
         """Return names of members sorted by creation order."""
-        return self.__tar.getnames()
+        if self.__reader is not None:
+            return self.__reader.getnames()
+        else:
+            return self.__tar.getnames()
 
     def read(self, arcname):
-        """Returns sring with content of given file from tarball."""
-        file_o = self.__tar.extractfile(arcname.encode('utf8'))
-        if not file_o:
-            return None
-        out = file_o.read()
-        file_o.close()
-        return out
+        """
+        Returns sring with content of given file from tarball.
+        Might be called from several threads.
+        """
+        with self.__lock:
+            return self.__reader.read(arcname.encode('utf8'))
 
     def write(self, arcname, data, mode=0644):
         """
         Stores given object to file in tarball.
+        data might be a string or seekable file object, the latter is copied
+        by chunks from its current position up to the end.
         Raises BadDataTypeError exception If data type isn't supported.
         """
         info = tarfile.TarInfo(arcname.encode('utf8'))
         info.mode = mode
         info.mtime = self.mtime
-        info.size = len(data)
 
-        self.__tar.addfile(info, cStringIO.StringIO(data))
+        if isinstance(data, basestring):
+            info.size = len(data)
+            fileobj = cStringIO.StringIO(data)
+        elif hasattr(data, 'read') and hasattr(data, 'seek'):
+            pos = data.tell()
+            data.seek(0, 2)
+            info.size = data.tell() - pos
+            data.seek(pos)
+            fileobj = data
+        else:
+            raise BadDataTypeError('Cannot write %s' % type(data))
+
+        self.__tar.addfile(info, fileobj)
+
+    def write_file(self, arcname, path, mode=0644):
+        """Stores content of file from path by chunks."""
+        f = open(path, 'rb')
+        try:
+            self.write(arcname, f, mode)
+        finally:
+            f.close()
+
+
+class _TarReader:
+    """Read tar members by seeking to offsets indexed on open"""
+
+    def __init__(self, name):
+        self._tar = tarfile.TarFile(name=name)
+
+        # member name to (offset, size) of its data to read it by one seek
+        self._index = {}
+        for info in self._tar.getmembers():
+            if info.isreg():
+                self._index[info.name] = (info.offset_data, info.size)
+            else:
+                self._index[info.name] = None
+
+    def close(self):
+        self._tar.close()
+
+    def getnames(self):
+        return self._tar.getnames()
+
+    def read(self, name):
+        member = self._index[name]
+        if member is None:
+            return None
+        offset, size = member
+        self._tar.fileobj.seek(offset)
+        return self._tar.fileobj.read(size)
+
+
+class _ZipReader:
+    """Read zip members in place, only central directory is read on open"""
+
+    def __init__(self, name):
+        self._zip = zipfile.ZipFile(name)
+        # zipfile keeps names of UTF-8 flagged members as unicode, but
+        # members are looked up by UTF-8 encoded names like in tar
+        self._names = []
+        self._index = {}
+        for info in self._zip.infolist():
+            name = info.filename
+            if isinstance(name, unicode):
+                name = name.encode('utf8')
+            self._names.append(name)
+            self._index[name] = info
+
+    def close(self):
+        self._zip.close()
+
+    def getnames(self):
+        return self._names
+
+    def read(self, name):
+        info = self._index[name]
+        if name.endswith('/'):
+            return None
+        return self._zip.read(info)